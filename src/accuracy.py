@@ -0,0 +1,118 @@
+from pendulum import Pendulum, INTEGRATORS
+from util import argv
+import numpy
+import math
+import time
+import ai
+
+
+GENERATION = argv("gen", -1)  # Agent that controls the reference
+TIME = argv("time", 20.0)  # Simulated seconds of the reference
+RATES = argv("rates", "60,30,20,15,10")  # Control rates in decisions per second
+SUBSTEPS = argv("substeps", "1,2,4,8")  # Integrator steps per decision
+REFERENCE_RATE = argv("reference-rate", 6000)  # RK4 steps per second of the reference
+HORIZON = argv("horizon", 0.25)  # Seconds of each open-loop replay
+ACCURACY = argv("accuracy", 0.01)  # Largest angle error in radians of accurate settings
+
+STATE: tuple = ("x", "angle", "angular_velocity", "horizontal_velocity")
+
+
+def reference(agent: ai.Agent, rate: int):
+    """
+    Returns the state before each decision of the agent, which starts like
+    in train.py and holds its output until the next decision, and the
+    accelerations it decided. Simulated with RK4 at REFERENCE_RATE.
+    """
+    pendulum = Pendulum()
+    pendulum.integrator = "rk4"
+    pendulum.substeps = max(REFERENCE_RATE // rate, 1)
+    inputs = numpy.zeros(5)
+
+    states = []
+    actions = []
+    for _ in range(round(TIME * rate)):
+        states.append(tuple(getattr(pendulum, name) for name in STATE))
+        inputs[0] = pendulum.x
+        inputs[1] = pendulum.horizontal_velocity
+        inputs[2] = math.cos(pendulum.angle)
+        inputs[3] = math.sin(pendulum.angle)
+        inputs[4] = pendulum.angular_velocity
+        actions.append(agent.forward(inputs)[0] * 30)
+        pendulum.step(actions[-1], 1 / rate)
+    states.append(tuple(getattr(pendulum, name) for name in STATE))
+    return states, actions
+
+
+def replay(states, actions, rate: int, integrator: str, substeps: int):
+    """
+    Returns the largest difference of x and of the angle to the reference
+    when its actions are replayed open-loop for HORIZON seconds, starting
+    every HORIZON seconds from the reference state, and the wall time per
+    simulated second. Short replays without the agent keep the errors from
+    being amplified by the instability of the upright pendulum. Replays
+    in which the reference reaches the rail are skipped.
+    """
+    steps = max(round(HORIZON * rate), 1)
+    x_error = angle_error = 0.0
+    seconds = simulated = 0.0
+
+    for start in range(0, len(actions) - steps + 1, steps):
+        # The rail stops the cart abruptly, which no integrator resolves
+        window = states[start : start + steps + 1]
+        if any(abs(state[0]) >= 1 for state in window):
+            continue
+
+        pendulum = Pendulum()
+        pendulum.integrator = integrator
+        pendulum.substeps = substeps
+        for name, value in zip(STATE, states[start]):
+            setattr(pendulum, name, value)
+
+        begin = time.perf_counter()
+        for action in actions[start : start + steps]:
+            pendulum.step(action, 1 / rate)
+        seconds += time.perf_counter() - begin
+        simulated += steps / rate
+
+        x, angle = states[start + steps][:2]
+        x_error = max(x_error, abs(pendulum.x - x))
+        angle_error = max(angle_error, abs(pendulum.angle - angle))
+
+    return x_error, angle_error, seconds / max(simulated, 1 / rate)
+
+
+def main():
+    agent = ai.Agent.load(GENERATION)
+    print(
+        f"Errors of {HORIZON} s open-loop replays against RK4 with "
+        f"{REFERENCE_RATE} steps per second, {TIME} s"
+    )
+    for rate in map(int, RATES.split(",")):
+        states, actions = reference(agent, rate)
+        cheapest = None
+
+        for integrator in INTEGRATORS:
+            for substeps in map(int, SUBSTEPS.split(",")):
+                x_error, angle_error, seconds = replay(
+                    states, actions, rate, integrator, substeps
+                )
+                accurate = angle_error <= ACCURACY
+                if accurate and (cheapest is None or seconds < cheapest[0]):
+                    cheapest = (seconds, integrator, substeps)
+
+                print(
+                    f"{rate} Hz, {integrator}, {substeps} substeps: "
+                    f"{seconds * 1e6:.0f} us per second; "
+                    f"x error: {x_error:.2e}; angle error: {angle_error:.2e}"
+                    + ("" if accurate else "; INACCURATE")
+                )
+
+        if cheapest is not None:
+            _, integrator, substeps = cheapest
+            print(f"{rate} Hz, cheapest accurate: {integrator}, {substeps} substeps")
+        else:
+            print(f"{rate} Hz, no accurate setting")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,20 @@
 from __future__ import annotations
+from multiprocessing import shared_memory
 import concurrent.futures
+import multiprocessing
+import collections
+import contextlib
 import threading
+import cProfile
+import hashlib
+import archive
 import random
 import numpy
 import util
 import time
 import json
+import math
+import abc
 import sys
 import os
 
@@ -18,12 +27,29 @@ except ModuleNotFoundError:
 
 
 GENERATION_DIRECTORY: str = util.abspath("gen")
+PROFILE_DIRECTORY: str = util.abspath("profiles")  # Stats of --profile-generation
 NUM_WORKERS: int = 8  # Number of workers/processes, not agents
 WEIGHT_CHANGE_STRENGTH: float = 0.01
 BIAS_CHANGE_STRENGTH: float = 0.005
 PRINT_RESULTS: bool = True
 SESSION_GENERATIONS: int = 2000
+EXACT_AGENTS: int = 2  # Best agents used for selection, never pruned
 TRANSFER_BEST_PERCENT: float = 0.5
+ES_SIGMA: float = 0.05  # Standard deviation of the perturbations of the mean
+ES_LEARNING_RATE: float = 0.03  # Step size of the mean per generation
+SAVE_FORMAT: str = "archive"  # "archive", "delta" or "json" (file per generation)
+CHECKPOINT_POLICY: str = "all"  # "all", "every" (nth generation) or "improved"
+CHECKPOINT_INTERVAL: int = 10  # Generations between checkpoints for "every"
+CHECKPOINT_QUEUE_SIZE: int = 16  # Older checkpoints are dropped when full
+TELEMETRY_QUEUE_SIZE: int = 256  # Older telemetry records are dropped when full
+
+MANIFEST_FILE: str = "latest.json"  # Points to the newest generation
+POPULATION_INTERVAL: int = 0  # Generations between population snapshots, 0 for off
+POPULATION_FILE: str = "population.npz"
+
+_archive_cache: dict = {}  # Generation archives by directory
+_archive_lock = threading.Lock()
+_manifest_lock = threading.RLock()
 
 
 def set_niceness(niceness):
@@ -61,27 +87,142 @@ def get_newest_generation(files: list[str]):
     return newest
 
 
-def save_generation_data(data: dict):
+def _archives():
+    """
+    Returns the archives of the generation directory by their SAVE_FORMAT name.
+    """
+    if GENERATION_DIRECTORY not in _archive_cache:
+        _archive_cache[GENERATION_DIRECTORY] = {
+            "archive": archive.GenerationArchive(GENERATION_DIRECTORY),
+            "delta": archive.DeltaArchive(GENERATION_DIRECTORY),
+        }
+    return _archive_cache[GENERATION_DIRECTORY]
+
+
+def _newest_archived_generation():
+    archives = _archives().values()
+    return max(generation_archive.newest() for generation_archive in archives)
+
+
+def _generation_file(generation: int):
+    return os.path.join(GENERATION_DIRECTORY, "gen" + str(generation) + ".json")
+
+
+def _generation_exists(generation: int):
+    archives = _archives().values()
+    if any(generation in generation_archive for generation_archive in archives):
+        return True
+    return os.path.isfile(_generation_file(generation))
+
+
+def _read_manifest():
+    """
+    Returns the generation of the manifest or None if it is missing or invalid.
+    """
+    try:
+        with open(os.path.join(GENERATION_DIRECTORY, MANIFEST_FILE), "r") as fp:
+            return int(json.load(fp)["generation"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _write_manifest(generation: int):
+    """
+    Atomically replace the manifest. Its modification time is set to that
+    of the directory afterwards, so adding or removing files marks it stale.
+    """
+    file_name = os.path.join(GENERATION_DIRECTORY, MANIFEST_FILE)
+    with open(file_name + ".tmp", "w") as fp:
+        json.dump({"generation": generation}, fp)
+    os.replace(file_name + ".tmp", file_name)
+    _stamp_manifest()
+
+
+def _stamp_manifest():
     """
-    Save data to file.
+    Set the modification time of the manifest to that of the directory.
     """
+    file_name = os.path.join(GENERATION_DIRECTORY, MANIFEST_FILE)
+    modified = os.stat(GENERATION_DIRECTORY).st_mtime_ns
+    os.utime(file_name, ns=(modified, modified))
+
+
+@contextlib.contextmanager
+def _other_files():
+    """
+    Keep a current manifest current while the enclosed code adds or replaces
+    files in the generation directory that are not generations.
+    """
+    with _manifest_lock:
+        current = _manifest_is_current()
+        yield
+        if current:
+            with contextlib.suppress(OSError):
+                _stamp_manifest()
+
 
-    def save_thread(data: dict):
-        os.path.isdir(GENERATION_DIRECTORY) or os.makedirs(GENERATION_DIRECTORY)
-        generation = data["generation"]
-        file_name = os.path.join(
-            GENERATION_DIRECTORY, "gen" + str(generation) + ".json"
+def _manifest_is_current():
+    """
+    Returns whether no file was added to or removed from the generation
+    directory since the manifest was written.
+    """
+    try:
+        manifest = os.stat(os.path.join(GENERATION_DIRECTORY, MANIFEST_FILE))
+        directory = os.stat(GENERATION_DIRECTORY)
+    except OSError:
+        return False
+    return manifest.st_mtime_ns == directory.st_mtime_ns
+
+
+def newest_generation():
+    """
+    Returns the number of the newest saved generation or -1.
+    If the manifest is missing or stale, the directory is scanned and the
+    manifest is rebuilt if possible.
+    """
+    generation = _read_manifest()
+    if (
+        generation is not None
+        and _manifest_is_current()
+        and _generation_exists(generation)
+        and _newest_archived_generation() <= generation
+    ):
+        return generation
+
+    if not os.path.isdir(GENERATION_DIRECTORY):
+        return -1
+    with _manifest_lock:
+        generation = max(
+            _newest_archived_generation(),
+            get_newest_generation(os.listdir(GENERATION_DIRECTORY)),
         )
+        if generation != -1:
+            with contextlib.suppress(OSError):  # E.g. a read-only directory
+                _write_manifest(generation)
+    return generation
 
-        data["layers"] = data["layers"].tolist()
-        data["weights"] = data["weights"].tolist()
-        data["biases"] = data["biases"].tolist()
 
-        with open(file_name, "w") as fp:
-            json.dump(data, fp)
+def save_generation_data(data: dict):
+    """
+    Save data to file and point the manifest to the newest generation.
+    """
+    os.path.isdir(GENERATION_DIRECTORY) or os.makedirs(GENERATION_DIRECTORY)
+    generation = data["generation"]
+
+    with _manifest_lock:
+        newest = max(generation, newest_generation())
+        if SAVE_FORMAT in ("archive", "delta"):
+            with _archive_lock:
+                _archives()[SAVE_FORMAT].append(data)
+        else:
+            data = dict(data)
+            data["layers"] = data["layers"].tolist()
+            data["weights"] = data["weights"].tolist()
+            data["biases"] = data["biases"].tolist()
 
-    thread = threading.Thread(target=save_thread, args=(data,), daemon=False)
-    thread.start()
+            with open(_generation_file(generation), "w") as fp:
+                json.dump(data, fp)
+        _write_manifest(newest)
 
 
 def _load_generation(generation=-1):
@@ -91,12 +232,17 @@ def _load_generation(generation=-1):
     Returns None if no save file is found.
     """
     if generation == -1:
-        os.path.isdir(GENERATION_DIRECTORY) or os.makedirs(GENERATION_DIRECTORY)
-        generation = get_newest_generation(os.listdir(GENERATION_DIRECTORY))
+        generation = newest_generation()
         if generation == -1:
             return None
 
-    file_name = os.path.join(GENERATION_DIRECTORY, "gen" + str(generation) + ".json")
+    for generation_archive in _archives().values():
+        data = generation_archive.load(generation)
+        if data is not None:
+            return data
+
+    # Fall back to the JSON save files of older versions
+    file_name = _generation_file(generation)
     try:
         with open(file_name, "r") as fp:
             data = json.load(fp)
@@ -108,6 +254,54 @@ def _load_generation(generation=-1):
     return data
 
 
+def save_population(state: dict):
+    """
+    Atomically save a snapshot of the whole population.
+    The state contains the generation data without weights, the weights and
+    biases of all agents and the states of both random number generators.
+    """
+    os.path.isdir(GENERATION_DIRECTORY) or os.makedirs(GENERATION_DIRECTORY)
+    file_name = os.path.join(GENERATION_DIRECTORY, POPULATION_FILE)
+    name, keys, position, has_gauss, cached_gaussian = state["numpy_random"]
+    numpy_random = [name, int(position), int(has_gauss), float(cached_gaussian)]
+
+    with _other_files():
+        with open(file_name + ".tmp", "wb") as fp:
+            numpy.savez(
+                fp,
+                weights=state["weights"],
+                biases=state["biases"],
+                numpy_random_keys=keys,
+                numpy_random=json.dumps(numpy_random),
+                random=json.dumps(state["random"]),
+                data=json.dumps(state["data"]),
+            )
+        os.replace(file_name + ".tmp", file_name)
+
+
+def load_population():
+    """
+    Returns the state saved by save_population or None if there is none.
+    """
+    file_name = os.path.join(GENERATION_DIRECTORY, POPULATION_FILE)
+    try:
+        with numpy.load(file_name) as snapshot:
+            version, internal_state, gauss_next = json.loads(str(snapshot["random"]))
+            name, *numpy_random = json.loads(str(snapshot["numpy_random"]))
+            state = {
+                "data": json.loads(str(snapshot["data"])),
+                "weights": snapshot["weights"],
+                "biases": snapshot["biases"],
+                "numpy_random": (name, snapshot["numpy_random_keys"], *numpy_random),
+                "random": (version, tuple(internal_state), gauss_next),
+            }
+    except FileNotFoundError:
+        return None
+
+    state["data"]["layers"] = numpy.array(state["data"]["layers"])
+    return state
+
+
 def seconds_to_str(t):
     seconds = int(t) % 60
     minutes = int(t / 60) % 60
@@ -143,15 +337,225 @@ def seconds_to_str(t):
 
 
 def _worker_process(func, *args):
-    set_niceness(-10)
     agent = Agent(*args)
 
-    score = func(agent)
+    with _profiled(agent.generation):
+        score = func(agent)
     ticks = agent.ticks
+    if not agent.estimated:
+        _report_score(score)
 
     return score, ticks
 
 
+# Arrays of the parent process, attached once by each persistent worker
+_shared_worker_data: dict = {}
+
+# Best scores of the current evaluation and how many of them must stay exact,
+# shared by workers when pruning
+_top_scores = None
+_top_count = None
+
+# Profiled generation and directory of the stats, and the profiler of a worker
+_profile = None
+_profiler = None
+
+
+def _initialize_worker(top_scores, top_count, profile, shared_args):
+    """
+    Initialize a process of the training pool.
+    profile is a tuple of the profiled generation and the directory for
+    the stats, or None. shared_args are the arguments of
+    _initialize_shared_worker or None.
+    """
+    global _top_scores, _top_count, _profile
+    set_niceness(-10)
+    _top_scores = top_scores
+    _top_count = top_count
+    _profile = profile
+    if shared_args is not None:
+        _initialize_shared_worker(*shared_args)
+
+
+@contextlib.contextmanager
+def _profiled(generation):
+    """
+    Profile the enclosed code if it evaluates the profiled generation.
+    The stats of all tasks of a worker are dumped to one file per process.
+    """
+    if _profile is None or generation != _profile[0]:
+        yield
+        return
+
+    global _profiler
+    if _profiler is None:
+        _profiler = cProfile.Profile()
+
+    _profiler.enable()
+    try:
+        yield
+    finally:
+        _profiler.disable()
+        file_name = f"profile{generation}_{os.getpid()}.prof"
+        _profiler.dump_stats(os.path.join(_profile[1], file_name))
+
+
+def exact_agents():
+    """
+    Returns the number of best agents whose scores must stay exact.
+    """
+    if _top_count is None:
+        return EXACT_AGENTS
+    return _top_count.value
+
+
+def score_threshold():
+    """
+    Returns the lowest of the exact_agents() best scores reported in the
+    current evaluation, or -inf if pruning is disabled. An agent that cannot
+    reach this score anymore may stop early without changing which agents
+    are selected.
+    """
+    if _top_scores is None:
+        return -math.inf
+    return _top_scores[_top_count.value - 1]
+
+
+def _report_score(score, top_scores=None, top_count=None):
+    """
+    Insert the score of a finished agent into the sorted best scores.
+    """
+    if top_scores is None:
+        top_scores, top_count = _top_scores, _top_count
+    if top_scores is None:
+        return
+
+    with top_scores.get_lock():
+        i = top_count.value - 1
+        if score <= top_scores[i]:
+            return
+        while i > 0 and score > top_scores[i - 1]:
+            top_scores[i] = top_scores[i - 1]
+            i -= 1
+        top_scores[i] = score
+
+
+def _initialize_shared_worker(
+    func, batch_func, layers, hidden_activation, output_activation, weights, biases
+):
+    """
+    Attach a worker process to the shared weights and biases.
+    weights and biases are tuples of (shared memory name, shape).
+    """
+    _shared_worker_data["func"] = func
+    _shared_worker_data["batch_func"] = batch_func
+    _shared_worker_data["layers"] = layers
+    _shared_worker_data["hidden_activation"] = hidden_activation
+    _shared_worker_data["output_activation"] = output_activation
+
+    for key, (name, shape) in (("weights", weights), ("biases", biases)):
+        memory = shared_memory.SharedMemory(name=name)
+        _shared_worker_data[key + "_memory"] = memory  # Keep the buffer alive
+        _shared_worker_data[key] = numpy.ndarray(shape, numpy.float64, memory.buf)
+
+
+def _shared_worker_process(index, generation, horizon=None):
+    data = _shared_worker_data
+    agent = Agent(
+        data["layers"],
+        data["weights"][index],
+        data["biases"][index],
+        data["hidden_activation"],
+        data["output_activation"],
+        generation,
+        horizon,
+    )
+
+    with _profiled(generation):
+        score = data["func"](agent)
+    ticks = agent.ticks
+    if not agent.estimated:
+        _report_score(score)
+
+    return score, ticks
+
+
+def _evaluate_chunk(
+    func,
+    batch_func,
+    layers,
+    weights,
+    biases,
+    hidden_activation,
+    output_activation,
+    generation,
+    horizon=None,
+):
+    """
+    Returns an array with the score and ticks of each agent of a chunk.
+    All agents are evaluated at once with batch_func if it is given.
+    batch_func returns the scores, or the scores and ticks of each agent
+    if agents can stop early. Estimated scores are not reported for pruning.
+    """
+    if batch_func is not None:
+        agents = AgentBatch(
+            layers,
+            weights,
+            biases,
+            hidden_activation,
+            output_activation,
+            generation,
+            horizon,
+        )
+        with _profiled(generation):
+            scores = batch_func(agents)
+        if isinstance(scores, tuple):
+            scores, ticks = scores
+        else:
+            ticks = numpy.full(len(scores), agents.ticks)
+        for score, estimated in zip(scores, agents.estimated):
+            if not estimated:
+                _report_score(score)
+        return numpy.column_stack((scores, ticks))
+
+    results = numpy.zeros((len(weights), 2))
+    for i in range(len(weights)):
+        agent = Agent(
+            layers,
+            weights[i],
+            biases[i],
+            hidden_activation,
+            output_activation,
+            generation,
+            horizon,
+        )
+        with _profiled(generation):
+            results[i] = func(agent), agent.ticks
+        if not agent.estimated:
+            _report_score(results[i, 0])
+
+    return results
+
+
+def _chunk_worker_process(*args):
+    return _evaluate_chunk(*args)
+
+
+def _shared_chunk_worker_process(indices, generation, horizon=None):
+    data = _shared_worker_data
+    return _evaluate_chunk(
+        data["func"],
+        data["batch_func"],
+        data["layers"],
+        data["weights"][indices],
+        data["biases"][indices],
+        data["hidden_activation"],
+        data["output_activation"],
+        generation,
+        horizon,
+    )
+
+
 def _activation_function(name: str):
     """
     Returns a activation function from a name.
@@ -160,19 +564,35 @@ def _activation_function(name: str):
 
 
 class ActivationFunction:
-    def sigmoid(z):
-        return 1 / (1 + numpy.exp(-z))
+    """
+    Activation functions for arrays and numbers.
+    If out is given, the result is written to that array instead of a new one.
+    """
+
+    def sigmoid(z, out=None):
+        if out is None:
+            return 1 / (1 + numpy.exp(-z))
+        numpy.negative(z, out)
+        numpy.exp(out, out)
+        numpy.add(out, 1, out)
+        return numpy.divide(1, out, out)
 
-    def tanh(z):
-        return numpy.tanh(z)
+    tanh = numpy.tanh  # The ufunc itself, which saves a call per layer
 
-    def relu(z):
-        return numpy.maximum(0, z)
+    def relu(z, out=None):
+        return numpy.maximum(0, z, out=out)
 
 
 class Agent:
     def __init__(
-        self, layers, weights, biases, hidden_activation, output_activation, generation
+        self,
+        layers,
+        weights,
+        biases,
+        hidden_activation,
+        output_activation,
+        generation,
+        horizon=None,
     ):
         self.layers = layers
         self.weights = weights
@@ -180,7 +600,10 @@ class Agent:
         self.hidden_activation = hidden_activation
         self.output_activation = output_activation
         self.generation = generation
+        self.horizon = horizon  # Ticks to simulate, None for the full episode
         self.ticks = 0
+        self.estimated = False  # True if the score was extrapolated by func
+        self._layer_steps = None
         self._initialize_arrays(weights, biases)
 
     def _initialize_arrays(self, weights, biases):
@@ -240,6 +663,7 @@ class Agent:
         """
         self.ticks += 1
         self.values[0][:] = inputs[:]
+        self._layer_steps = None  # The arrays of self.values are replaced
 
         for i in range(len(self.layers) - 2):
             self.values[i + 1] = self.hidden_activation(
@@ -252,6 +676,397 @@ class Agent:
 
         return self.values[-1]
 
+    def forward(self, inputs: numpy.ndarray):
+        """
+        Run a single iteration through the network without allocating arrays.
+        Equivalent to run(*inputs), but every layer is computed in place in
+        the arrays of self.values, with the biases folded into the weights.
+        The weights are copied on the first call. The returned array is
+        overwritten by the next call.
+        """
+        self.ticks += 1
+        if self._layer_steps is None:
+            self._initialize_layer_steps()
+        self.values[0][:] = inputs
+
+        for values, weights, out, activation in self._layer_steps:
+            numpy.dot(values, weights, out)
+            activation(out, out)
+
+        return out
+
+    def _initialize_layer_steps(self):
+        """
+        Bind the arrays used by each layer in forward. Each layer gets a
+        trailing constant 1 and the weights of the next layer a row of
+        biases, so a single dot product adds the biases as well.
+        """
+        extended = [numpy.ones(layer + 1) for layer in self.layers]
+        self.values = [values[:-1] for values in extended]
+
+        self._layer_steps = []
+        for i in range(len(self.layers) - 1):
+            if i + 2 < len(self.layers):
+                activation = self.hidden_activation
+            else:
+                activation = self.output_activation
+            weights = numpy.vstack((self.weights[i], self.biases[i]))
+            self._layer_steps.append(
+                (extended[i], weights, self.values[i + 1], activation)
+            )
+
+
+class AgentBatch:
+    """
+    Evaluates the networks of many agents at once.
+    weights and biases contain the flat vectors of one agent per row,
+    as stored by ReinforcementLearningModel.
+    """
+
+    def __init__(
+        self,
+        layers,
+        weights,
+        biases,
+        hidden_activation,
+        output_activation,
+        generation,
+        horizon=None,
+    ):
+        self.layers = layers
+        self.num_agents = len(weights)
+        self.hidden_activation = hidden_activation
+        self.output_activation = output_activation
+        self.generation = generation
+        self.horizon = horizon  # Ticks to simulate, None for the full episode
+        self.ticks = 0
+        self.estimated = numpy.zeros(self.num_agents, dtype=bool)  # Of each agent
+        self._initialize_arrays(weights, biases)
+
+    def _initialize_arrays(self, weights, biases):
+        """
+        Construct stacked arrays for values, biases and weights for each layer
+        """
+        self.values = []
+        self.biases = []
+        self.weights = []
+
+        bias_index = weight_index = 0
+        for i, layer in enumerate(self.layers):
+            self.values.append(numpy.zeros((self.num_agents, layer)))
+
+            if i + 1 == len(self.layers):
+                continue
+            next_layer = self.layers[i + 1]
+
+            layer_biases = biases[:, bias_index : bias_index + next_layer]
+            self.biases.append(layer_biases)
+            bias_index += next_layer
+
+            layer_weights = weights[
+                :, weight_index : weight_index + layer * next_layer
+            ].reshape((self.num_agents, layer, next_layer))
+            self.weights.append(layer_weights)
+            weight_index += layer * next_layer
+
+    def run(self, inputs: numpy.ndarray):
+        """
+        Run a single iteration through the networks of all agents.
+        inputs has the shape (agents, inputs), the result (agents, outputs).
+        """
+        self.ticks += 1
+        self.values[0][:] = inputs
+
+        for i in range(len(self.layers) - 2):
+            self.values[i + 1] = self.hidden_activation(
+                numpy.einsum("ni,nio->no", self.values[i], self.weights[i])
+                + self.biases[i]
+            )
+
+        self.values[-1] = self.output_activation(
+            numpy.einsum("ni,nio->no", self.values[-2], self.weights[-1])
+            + self.biases[-1]
+        )
+
+        return self.values[-1]
+
+    def repeat(self, repeats: int):
+        """
+        Repeat every agent, each copy directly following its original,
+        e.g. to evaluate every agent on several episodes at once.
+        """
+        self.num_agents *= repeats
+        self.values = [numpy.repeat(values, repeats, 0) for values in self.values]
+        self.biases = [numpy.repeat(biases, repeats, 0) for biases in self.biases]
+        self.weights = [numpy.repeat(weights, repeats, 0) for weights in self.weights]
+
+    def keep(self, mask):
+        """
+        Remove every agent where mask is False, e.g. agents that stopped early.
+        """
+        self.num_agents = int(numpy.count_nonzero(mask))
+        self.values = [values[mask] for values in self.values]
+        self.biases = [biases[mask] for biases in self.biases]
+        self.weights = [weights[mask] for weights in self.weights]
+
+
+class FitnessCache:
+    """
+    Bounded cache of the results of agents, keyed by a hash of their
+    parameters and the episode they were evaluated on. The least recently
+    used result is evicted when the cache is full.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._results = collections.OrderedDict()
+
+    @staticmethod
+    def key(weights: numpy.ndarray, biases: numpy.ndarray, episode):
+        digest = hashlib.blake2b(weights.tobytes(), digest_size=16)
+        digest.update(biases.tobytes())
+        return digest.digest(), episode
+
+    def __len__(self):
+        return len(self._results)
+
+    def get(self, key):
+        """
+        Returns the cached result of a key or None.
+        """
+        result = self._results.get(key)
+        if result is not None:
+            self._results.move_to_end(key)
+        return result
+
+    def put(self, key, result):
+        self._results[key] = result
+        self._results.move_to_end(key)
+        while len(self._results) > self.size:
+            self._results.popitem(last=False)
+
+
+def _timed_task(func, *args):
+    """
+    Returns the result of a worker task with the process id of the worker
+    and the seconds the task ran.
+    """
+    start = time.perf_counter()
+    result = func(*args)
+    return result, os.getpid(), time.perf_counter() - start
+
+
+class PhaseTimer:
+    """
+    Wall time of the phases of a generation and of the worker tasks.
+    Every method returns immediately if the timer is disabled.
+    """
+
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self.phases = {}  # Seconds by phase
+        self.tasks = []  # Seconds from submission until each task was done
+        self.workers = {}  # Seconds each worker process ran tasks, by pid
+        self._submitted = {}  # Submission time by future
+        self._last = 0.0
+
+    def start(self):
+        if not self.enabled:
+            return
+        self.phases = {}
+        self.tasks = []
+        self.workers = {}
+        self._last = time.perf_counter()
+
+    def lap(self, phase: str):
+        """
+        Add the time since the last lap to a phase.
+        """
+        if not self.enabled:
+            return
+        t = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + t - self._last
+        self._last = t
+
+    def submit(self, executor, func, *args):
+        """
+        Submit a worker task, which is timed if the timer is enabled.
+        """
+        if not self.enabled:
+            return executor.submit(func, *args)
+        future = executor.submit(_timed_task, func, *args)
+        self._submitted[future] = time.perf_counter()
+        return future
+
+    def results(self, futures: list):
+        """
+        Wait for submitted tasks and return their results in order.
+        Records when each task was done and how long each worker ran.
+        """
+        if not self.enabled:
+            return [future.result() for future in futures]
+
+        for future in concurrent.futures.as_completed(futures):
+            self.tasks.append(time.perf_counter() - self._submitted.pop(future))
+            _, pid, seconds = future.result()
+            self.workers[pid] = self.workers.get(pid, 0.0) + seconds
+        return [future.result()[0] for future in futures]
+
+    def record(self, generation: int):
+        """
+        Returns the timings of the generation as a JSON object.
+        The least and most busy workers expose stragglers independently of
+        the chunk size.
+        """
+        return {
+            "generation": generation,
+            **self.phases,
+            "total": sum(self.phases.values()),
+            "tasks": len(self.tasks),
+            "task_min": min(self.tasks, default=0.0),
+            "task_max": max(self.tasks, default=0.0),
+            "workers": len(self.workers),
+            "worker_min": min(self.workers.values(), default=0.0),
+            "worker_max": max(self.workers.values(), default=0.0),
+        }
+
+
+class BackgroundWriter(abc.ABC):
+    """
+    Writes queued items on a single background thread, which is started
+    with the first item. Queuing never blocks: when the queue is full, the
+    oldest pending item is dropped in favour of the newer one.
+    """
+
+    batch_size: int = 0  # Maximum items per call of write, 0 for all pending
+
+    def __init__(self, queue_size: int):
+        self.queue_size = max(queue_size, 1)
+        self.dropped = 0
+        self._pending = collections.deque()
+        self._writing = False
+        self._condition = threading.Condition()
+        self._thread = None
+
+    @abc.abstractmethod
+    def write(self, items: list):
+        """
+        Write items on the background thread and handle their errors.
+        """
+
+    def _queue(self, item):
+        with self._condition:
+            if len(self._pending) >= self.queue_size:
+                self._pending.popleft()
+                self.dropped += 1
+            self._pending.append(item)
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._condition.notify_all()
+
+    def flush(self):
+        """
+        Block until all queued items are written.
+        """
+        with self._condition:
+            while self._pending or self._writing:
+                self._condition.wait()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                count = self.batch_size or len(self._pending)
+                items = [self._pending.popleft() for _ in range(count)]
+                self._writing = True
+
+            try:
+                self.write(items)
+            finally:
+                with self._condition:
+                    self._writing = False
+                    self._condition.notify_all()
+
+
+class CheckpointWriter(BackgroundWriter):
+    """
+    Saves generation data in the background, one checkpoint at a time.
+    """
+
+    batch_size: int = 1
+
+    def __init__(
+        self,
+        policy: str = "all",  # "all", "every" or "improved"
+        interval: int = 1,  # Generations between checkpoints for "every"
+        queue_size: int = 16,  # Maximum number of pending checkpoints
+    ):
+        if policy not in ("all", "every", "improved"):
+            raise ValueError(f"Unknown checkpoint policy: {policy}")
+
+        super().__init__(queue_size)
+        self.policy = policy
+        self.interval = max(interval, 1)
+        self.best_score = None
+        self.saved = 0
+        self.last_generation = None  # Last submitted generation
+
+    def should_save(self, generation: int, score: float):
+        if self.policy == "every":
+            return generation % self.interval == 0
+        if self.policy == "improved":
+            return self.best_score is None or score > self.best_score
+        return True
+
+    def submit(self, data: dict, score: float, force: bool = False):
+        """
+        Queue generation data for saving if the policy accepts it.
+        Returns whether the data was queued.
+        """
+        if not (force or self.should_save(data["generation"], score)):
+            return False
+        if self.best_score is None or score > self.best_score:
+            self.best_score = score
+        self.last_generation = data["generation"]
+        self._queue(data)
+        return True
+
+    def write(self, items: list):
+        for data in items:
+            try:
+                save_generation_data(data)
+                self.saved += 1
+            except Exception as error:
+                print(
+                    f"Could not save generation {data['generation']}: {error}",
+                    file=sys.stderr,
+                )
+
+
+class TelemetryStream(BackgroundWriter):
+    """
+    Appends one JSON line per record to a file in the background, e.g. for
+    monitor.py. All pending records are written at once.
+    """
+
+    def __init__(self, file_name: str, queue_size: int = TELEMETRY_QUEUE_SIZE):
+        super().__init__(queue_size)
+        self.file_name = file_name
+
+    def publish(self, record: dict):
+        self._queue(record)
+
+    def write(self, items: list):
+        try:
+            lines = "".join(json.dumps(record) + "\n" for record in items)
+            with open(self.file_name, "a") as fp:
+                fp.write(lines)
+        except Exception as error:
+            print(f"Could not write telemetry: {error}", file=sys.stderr)
+
 
 class ReinforcementLearningModel:
     def __init__(
@@ -263,9 +1078,54 @@ class ReinforcementLearningModel:
         hidden: list[int] = [],  # Number of neurons per hidden layer
         hidden_activation: str = "relu",  # Activation function for hidden layers
         output_activation: str = "sigmoid",  # Activation function for output layer
+        shared_memory: bool = False,  # Share weights with persistent workers
+        batch_func=None,  # Evaluates an AgentBatch, used for chunks
+        chunk_size: int = 1,  # Agents per worker task, 0 for one task per worker
+        cache_size: int = 0,  # Number of cached scores, 0 to disable the cache
+        prune: bool = False,  # Share the best scores so agents can stop early
+        rungs: list = [],  # (Ticks, kept fraction) per rung before the full episode
+        optimizer: str = "hill",  # "hill" (mutation and selection) or "es"
+        timing_file: str = "",  # JSONL file for the phase timings, "" for off
+        profile_generation: int = -1,  # Generation profiled in the workers, -1 for off
+        telemetry_file: str = "",  # JSONL file for the stats of each generation
+        episode_key=None,  # Returns what besides the agent decides its score
+        checkpoint_policy: str = None,  # See CHECKPOINT_POLICY, None for its value
+        checkpoint_interval: int = None,  # See CHECKPOINT_INTERVAL, None for its value
+        population_interval: int = None,  # See POPULATION_INTERVAL, None for its value
     ):
         self.func = func
+        self.batch_func = batch_func
+        self._last_checkpoint = None
         self.num_agents = num_agents
+        self.shared_memory = shared_memory
+        self.chunk_size = chunk_size
+        self.cache = FitnessCache(cache_size) if cache_size else None
+        self.cache_stats = (0, 0)  # Hits and misses of the last generation
+        self.cached_ticks = 0  # Ticks the cache saved in the last generation
+        self.prune = prune
+        self._top_scores = None
+        self._top_count = None
+        self.rungs = rungs
+        self.optimizer = optimizer
+        self.timing_file = timing_file
+        self.timer = PhaseTimer(bool(timing_file))
+        self.profile_generation = profile_generation
+        self.telemetry = TelemetryStream(telemetry_file) if telemetry_file else None
+        self._mutation = {}  # Mutation stats of the current generation
+
+        # Evolution strategies rank the whole population, so nothing is pruned
+        self.exact_agents = num_agents if optimizer == "es" else EXACT_AGENTS
+        self.rung_ticks = []  # Ticks per rung of the last generation
+        self.episode_key = episode_key or (lambda generation: generation)
+        self.checkpoints = CheckpointWriter(
+            CHECKPOINT_POLICY if checkpoint_policy is None else checkpoint_policy,
+            CHECKPOINT_INTERVAL if checkpoint_interval is None else checkpoint_interval,
+            CHECKPOINT_QUEUE_SIZE,
+        )
+        if population_interval is None:
+            population_interval = POPULATION_INTERVAL
+        self.population_interval = population_interval
+        self._shared_memory_blocks = []
         self._load_data(inputs, outputs, hidden, hidden_activation, output_activation)
 
     def _load_data(self, *args):
@@ -273,7 +1133,9 @@ class ReinforcementLearningModel:
         self.biases = []
         self.data = _load_generation()
 
-        if self.data:
+        if self._restore_population(load_population()):
+            pass
+        elif self.data:
             weights = numpy.array(self.data["weights"])
             biases = numpy.array(self.data["biases"])
             self.weights = weights[numpy.newaxis, :].repeat(self.num_agents, 0)
@@ -284,6 +1146,40 @@ class ReinforcementLearningModel:
         self.hidden_activation = _activation_function(self.data["hidden_activation"])
         self.output_activation = _activation_function(self.data["output_activation"])
 
+    def _restore_population(self, state):
+        """
+        Continue from a population snapshot if it is at least as new as the
+        newest saved generation and fits the model. Returns whether it did.
+        """
+        if state is None or state["weights"].shape[0] != self.num_agents:
+            return False
+        if self.data and state["data"]["generation"] < self.data["generation"]:
+            return False
+
+        self.data = state["data"]
+        self.weights = state["weights"]
+        self.biases = state["biases"]
+        numpy.random.set_state(state["numpy_random"])
+        random.setstate(state["random"])
+        return True
+
+    def _population_state(self):
+        """
+        Returns a snapshot of the population for save_population.
+        """
+        data = dict(self.data)
+        data.pop("weights", None)
+        data.pop("biases", None)
+        data["layers"] = numpy.asarray(data["layers"]).tolist()
+
+        return {
+            "data": data,
+            "weights": self.weights.copy(),
+            "biases": self.biases.copy(),
+            "numpy_random": numpy.random.get_state(),
+            "random": random.getstate(),
+        }
+
     def _default_data(
         self, inputs, outputs, hidden, hidden_activation, output_activation
     ):
@@ -307,62 +1203,376 @@ class ReinforcementLearningModel:
     def train(self):
         set_niceness(-10)
         last_time = time.time()
+        population = None
 
-        with concurrent.futures.ProcessPoolExecutor(NUM_WORKERS) as executor:
-            for _ in range(SESSION_GENERATIONS):
-                self.data["generation"] += 1
-                self._iterate(executor)
-
-                t = time.time()
-                self.data["time"] += t - last_time
-                last_time = t
-
-    def _iterate(self, executor):
-        self._adjust_weights()
-        self._adjust_weights()
-        self._adjust_weights()
-
-        workers = [
-            executor.submit(
-                _worker_process,
+        try:
+            with self._create_executor() as executor:
+                for _ in range(SESSION_GENERATIONS):
+                    self.data["generation"] += 1
+                    self._iterate(executor)
+
+                    t = time.time()
+                    self.data["time"] += t - last_time
+                    last_time = t
+
+                    if self.population_interval:
+                        population = self._population_state()
+                        if self.data["generation"] % self.population_interval == 0:
+                            save_population(population)
+                            population = None
+        finally:
+            self._release_shared_memory()
+
+            # Keep the population of the last completed generation
+            if population is not None:
+                save_population(population)
+
+            # Always keep the state of the last generation
+            if self._last_checkpoint is not None:
+                data, score = self._last_checkpoint
+                if self.checkpoints.last_generation != data["generation"]:
+                    self.checkpoints.submit(data, score, force=True)
+            self.checkpoints.flush()
+            if self.telemetry is not None:
+                self.telemetry.flush()
+
+    def _create_executor(self):
+        """
+        Returns the process pool used for training.
+        With shared memory, the workers attach to the weights and biases once
+        and only receive agent indices afterwards.
+        """
+        shared_args = None
+        if self.shared_memory:
+            self.weights = self._share_array(self.weights)
+            self.biases = self._share_array(self.biases)
+            shared_args = (
                 self.func,
+                self.batch_func,
                 self.data["layers"],
-                self.weights[i],
-                self.biases[i],
                 self.hidden_activation,
                 self.output_activation,
-                self.data["generation"],
+                (self._shared_memory_blocks[0].name, self.weights.shape),
+                (self._shared_memory_blocks[1].name, self.biases.shape),
             )
-            for i in range(self.num_agents)
-        ]
 
+        profile = None
+        if self.profile_generation >= 0:
+            os.path.isdir(PROFILE_DIRECTORY) or os.makedirs(PROFILE_DIRECTORY)
+            profile = (self.profile_generation, PROFILE_DIRECTORY)
+
+        self._top_scores = self._top_count = None
+        if self.prune:
+            self._top_scores = multiprocessing.Array("d", self.num_agents)
+            self._top_count = multiprocessing.Value("i", EXACT_AGENTS)
+
+        return concurrent.futures.ProcessPoolExecutor(
+            NUM_WORKERS,
+            initializer=_initialize_worker,
+            initargs=(self._top_scores, self._top_count, profile, shared_args),
+        )
+
+    def _share_array(self, array):
+        """
+        Returns a copy of the array which is stored in shared memory.
+        """
+        array = numpy.asarray(array, numpy.float64)
+        memory = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        self._shared_memory_blocks.append(memory)
+
+        shared = numpy.ndarray(array.shape, numpy.float64, memory.buf)
+        shared[:] = array
+        return shared
+
+    def _release_shared_memory(self):
+        """
+        Move weights and biases back to private memory and free shared memory.
+        """
+        if not self._shared_memory_blocks:
+            return
+
+        self.weights = self.weights.copy()
+        self.biases = self.biases.copy()
+
+        for memory in self._shared_memory_blocks:
+            memory.close()
+            memory.unlink()
+        self._shared_memory_blocks = []
+
+    def _iterate(self, executor):
+        self.timer.start()
+        start = time.perf_counter()
+        self._mutation = {}
+
+        if self.optimizer == "es":
+            noise = self._sample_population()
+        else:
+            self._adjust_weights()
+            self._adjust_weights()
+            self._adjust_weights()
+        self.timer.lap("mutation")
+
+        if self.rungs:
+            evaluation, passed = self._race(executor)
+        else:
+            indices = list(range(self.num_agents))
+            evaluation = self._evaluate(executor, indices, None, self.exact_agents)
+            passed = [0] * self.num_agents
+
+        # Agents that passed more rungs rank higher, then by score
         results = sorted(
-            [(i, *worker.result()) for i, worker in enumerate(workers)],
-            key=lambda n: n[1],
+            [(i, *result, passed[i]) for i, result in enumerate(evaluation)],
+            key=lambda n: (n[3], n[1]),
             reverse=True,
         )
+        self.timer.lap("sort")
 
+        # Ticks saved by the cache still count, as if they were simulated
         self.data["ticks"] += sum([results[i][2] for i in range(len(results))])
+        self.data["ticks"] += self.cached_ticks
 
         # Save generation data to file
         generation_data = dict(self.data)
-        generation_data["weights"] = self.weights[results[0][0]]
-        generation_data["biases"] = self.biases[results[0][0]]
-        save_generation_data(generation_data)
-
-        # Use best weights and biases
-        new_agents = [results[0][0]] * int(self.num_agents * TRANSFER_BEST_PERCENT)
-        new_agents.extend([results[1][0]] * ((self.num_agents - len(new_agents)) // 3))
-        new_agents.extend(
-            random.choices(range(self.num_agents), k=self.num_agents - len(new_agents))
-        )
+        generation_data["weights"] = self.weights[results[0][0]].copy()
+        generation_data["biases"] = self.biases[results[0][0]].copy()
+        self._last_checkpoint = (generation_data, results[0][1])
+        self.checkpoints.submit(generation_data, results[0][1])
+        self.timer.lap("checkpoint")
+
+        if self.optimizer == "es":
+            self._update_mean(results, noise)
+        else:
+            # Use best weights and biases
+            new_agents = [results[0][0]] * int(self.num_agents * TRANSFER_BEST_PERCENT)
+            new_agents.extend(
+                [results[1][0]] * ((self.num_agents - len(new_agents)) // 3)
+            )
+            new_agents.extend(
+                random.choices(
+                    range(self.num_agents), k=self.num_agents - len(new_agents)
+                )
+            )
 
-        for i, agent in enumerate(new_agents):
-            self.weights[i] = self.weights[agent].copy()
-            self.biases[i] = self.biases[agent].copy()
+            for i, agent in enumerate(new_agents):
+                self.weights[i] = self.weights[agent].copy()
+                self.biases[i] = self.biases[agent].copy()
+        self.timer.lap("selection")
 
         # Print results
         self._print_results(results)
+        if self.telemetry is not None:
+            self._publish(results, time.perf_counter() - start)
+        self.timer.lap("print")
+
+        if self.timer.enabled:
+            with open(self.timing_file, "a") as fp:
+                fp.write(json.dumps(self.timer.record(self.data["generation"])) + "\n")
+
+    def _publish(self, results, seconds: float):
+        """
+        Publish the stats of the generation to the telemetry stream.
+        With successive halving, only the finalists are compared.
+        """
+        scores = [result[1] for result in results if result[3] == results[0][3]]
+        record = {
+            "generation": self.data["generation"],
+            "best": scores[0],
+            "median": float(numpy.median(scores)),
+            "worst": scores[-1],
+            "ticks": sum(result[2] for result in results),
+            "total_ticks": self.data["ticks"],
+            "seconds": seconds,
+            "generations_per_second": 1 / seconds if seconds else 0.0,
+            "time": time.time(),
+            **self._mutation,
+        }
+        if self.cache is not None:
+            record["cache_hits"], record["cache_misses"] = self.cache_stats
+            record["cached_ticks"] = self.cached_ticks
+        self.telemetry.publish(record)
+
+    def _race(self, executor):
+        """
+        Successive halving: all agents are scored on the short horizon of the
+        first rung, the best fraction of them on the next rung and only the
+        finalists on the full episode.
+        Returns the score and ticks of every agent, where the score is from
+        the last rung it ran, and the number of rungs it passed.
+        """
+        results = [None] * self.num_agents
+        ticks = [0] * self.num_agents
+        passed = [0] * self.num_agents
+        indices = list(range(self.num_agents))
+        hits = misses = cached_ticks = 0
+        self.rung_ticks = []
+
+        for rung, (horizon, keep) in enumerate([*self.rungs, (None, 0)]):
+            # Evolution strategies rank every agent, so exact_agents may
+            # exceed the agents that advance to the next rung
+            survivors = max(EXACT_AGENTS, math.ceil(len(indices) * keep))
+            survivors = min(survivors, len(indices))
+            exact = min(max(self.exact_agents, survivors), len(indices))
+
+            evaluation = self._evaluate(executor, indices, horizon, exact)
+            hits += self.cache_stats[0]
+            misses += self.cache_stats[1]
+            cached_ticks += self.cached_ticks
+            self.rung_ticks.append(sum(result[1] for result in evaluation))
+
+            for i, (score, agent_ticks) in zip(indices, evaluation):
+                results[i] = score
+                ticks[i] += agent_ticks
+                passed[i] = rung
+
+            indices = sorted(indices, key=lambda i: results[i], reverse=True)
+            indices = indices[:survivors]
+            self.timer.lap("racing")
+
+        self.cache_stats = (hits, misses)
+        self.cached_ticks = cached_ticks
+        return list(zip(results, ticks)), passed
+
+    def _evaluate(self, executor, indices: list, horizon=None, exact=EXACT_AGENTS):
+        """
+        Returns the score and ticks of the agents with the given indices,
+        simulated for horizon ticks or the full episode. When pruning, only
+        the best exact scores are guaranteed to be exact.
+        Agents found in the fitness cache, and copies of other agents of the
+        generation, are not simulated again and report 0 ticks. The ticks
+        they saved are stored in cached_ticks.
+        """
+        if self._top_scores is not None:
+            self._top_scores[:] = [-math.inf] * self.num_agents
+            self._top_count.value = exact
+
+        self.cached_ticks = 0
+        if self.cache is None:
+            return self._dispatch(executor, indices, horizon)
+
+        episode = self.episode_key(self.data["generation"])
+        if horizon is not None:
+            episode = (episode, horizon)
+        results = [None] * len(indices)
+        pending = {}  # Agents to simulate by key
+        hits = 0
+
+        for n, i in enumerate(indices):
+            key = FitnessCache.key(self.weights[i], self.biases[i], episode)
+            cached = self.cache.get(key)
+            if cached is not None:
+                results[n] = (cached[0], 0)
+                self.cached_ticks += cached[1]
+                hits += 1
+            elif key in pending:
+                pending[key].append(n)
+                hits += 1
+            else:
+                pending[key] = [n]
+
+        # Cached scores let the workers prune from the start
+        if self._top_scores is not None:
+            for result in results:
+                if result is not None:
+                    _report_score(result[0], self._top_scores, self._top_count)
+
+        simulated = [indices[positions[0]] for positions in pending.values()]
+        self.timer.lap("cache")
+        evaluated = self._dispatch(executor, simulated, horizon)
+
+        for positions, result in zip(pending.values(), evaluated):
+            results[positions[0]] = result
+            for n in positions[1:]:
+                results[n] = (result[0], 0)
+                self.cached_ticks += result[1]
+
+        # Pruned agents report a bound below the best exact scores
+        limit = -math.inf
+        if self._top_scores is not None and len(results) >= exact:
+            limit = sorted(result[0] for result in results)[-exact]
+
+        for key, result in zip(pending, evaluated):
+            if result[0] >= limit:
+                self.cache.put(key, result)
+        self.timer.lap("cache")
+
+        self.cache_stats = (hits, len(simulated))
+        return results
+
+    def _dispatch(self, executor, indices: list, horizon=None):
+        """
+        Returns the score and ticks of the agents with the given indices.
+        With a chunk size other than 1, each worker task evaluates a
+        contiguous slice of the indices.
+        """
+        generation = self.data["generation"]
+
+        if self.chunk_size == 1:
+            if self.shared_memory:
+                workers = [
+                    self.timer.submit(
+                        executor, _shared_worker_process, i, generation, horizon
+                    )
+                    for i in indices
+                ]
+            else:
+                workers = [
+                    self.timer.submit(
+                        executor,
+                        _worker_process,
+                        self.func,
+                        self.data["layers"],
+                        self.weights[i],
+                        self.biases[i],
+                        self.hidden_activation,
+                        self.output_activation,
+                        generation,
+                        horizon,
+                    )
+                    for i in indices
+                ]
+            self.timer.lap("submit")
+            results = self.timer.results(workers)
+            self.timer.lap("wait")
+            return results
+
+        chunk_size = self.chunk_size or -(-len(indices) // NUM_WORKERS)
+        chunks = [
+            indices[start : start + chunk_size]
+            for start in range(0, len(indices), chunk_size)
+        ]
+
+        if self.shared_memory:
+            workers = [
+                self.timer.submit(
+                    executor, _shared_chunk_worker_process, chunk, generation, horizon
+                )
+                for chunk in chunks
+            ]
+        else:
+            workers = [
+                self.timer.submit(
+                    executor,
+                    _chunk_worker_process,
+                    self.func,
+                    self.batch_func,
+                    self.data["layers"],
+                    self.weights[chunk],
+                    self.biases[chunk],
+                    self.hidden_activation,
+                    self.output_activation,
+                    generation,
+                    horizon,
+                )
+                for chunk in chunks
+            ]
+        self.timer.lap("submit")
+
+        results = []
+        for result in self.timer.results(workers):
+            results.extend((score, int(ticks)) for score, ticks in result)
+        self.timer.lap("wait")
+
+        return results
 
     def _adjust_weights(self):
         """
@@ -379,6 +1589,55 @@ class ReinforcementLearningModel:
         bias_changes = numpy.random.uniform(-strength, strength, size=size - 1)
         self.biases[numpy.arange(1, size), bias_indices] += bias_changes
 
+        stats = self._mutation
+        stats["weight_changes"] = stats.get("weight_changes", 0.0) + float(
+            numpy.abs(weight_changes).sum()
+        )
+        stats["bias_changes"] = stats.get("bias_changes", 0.0) + float(
+            numpy.abs(bias_changes).sum()
+        )
+
+    def _sample_population(self):
+        """
+        Replace the population with antithetic perturbations of the mean,
+        which is kept by the first agent. Agents after the pairs stay at the
+        mean. Returns the noise of each pair.
+        """
+        split = self.weights.shape[1]
+        pairs = (self.num_agents - 1) // 2
+        mean = numpy.concatenate((self.weights[0], self.biases[0]))
+
+        noise = numpy.random.standard_normal((pairs, len(mean)))
+        parameters = numpy.repeat(mean[numpy.newaxis, :], self.num_agents, 0)
+        parameters[1 : 1 + pairs] += ES_SIGMA * noise
+        parameters[1 + pairs : 1 + 2 * pairs] -= ES_SIGMA * noise
+
+        self.weights[:] = parameters[:, :split]
+        self.biases[:] = parameters[:, split:]
+        return noise
+
+    def _update_mean(self, results, noise):
+        """
+        Move the mean along the noise, weighted by the centered ranks of the
+        agents, and reset every agent to the new mean.
+        """
+        split = self.weights.shape[1]
+        pairs = len(noise)
+        mean = numpy.concatenate((self.weights[0], self.biases[0]))
+
+        if pairs:
+            ranks = numpy.empty(self.num_agents)
+            ranks[[result[0] for result in results]] = numpy.arange(self.num_agents)
+            utilities = 0.5 - ranks / (self.num_agents - 1)
+            shaped = utilities[1 : 1 + pairs] - utilities[1 + pairs : 1 + 2 * pairs]
+            gradient = shaped @ noise / (2 * pairs * ES_SIGMA)
+            mean += ES_LEARNING_RATE * gradient
+            self._mutation["es_step"] = float(numpy.linalg.norm(gradient))
+        self._mutation["es_sigma"] = ES_SIGMA
+
+        self.weights[:] = mean[:split]
+        self.biases[:] = mean[split:]
+
     def _print_results(self, results):
         if PRINT_RESULTS:
             gen = self.data["generation"]
@@ -395,4 +1654,10 @@ class ReinforcementLearningModel:
 
             if not min_time == max_time == gen_time // self.num_agents:
                 string += f"; Gen Time: {gen_time}; Min Time: {min_time}; Max Time: {max_time}"
+            if self.cache is not None:
+                hits, misses = self.cache_stats
+                string += f"; Cache Hits: {hits}; Cache Misses: {misses}"
+                string += f"; Cached Ticks: {self.cached_ticks}"
+            if self.rungs:
+                string += "; Rung Ticks: " + "/".join(map(str, self.rung_ticks))
             print(string)
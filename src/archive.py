@@ -0,0 +1,534 @@
+from util import abspath, argv
+import tempfile
+import numpy
+import json
+import abc
+import os
+
+
+ARCHIVE_FILE: str = "generations.bin"
+HEADER_FILE: str = "generations.json"
+DELTA_FILE: str = "deltas.bin"
+DELTA_INDEX_FILE: str = "deltas.index"
+DELTA_HEADER_FILE: str = "deltas.json"
+KEYFRAME_INTERVAL: int = 100  # Saved generations between full keyframes
+RECORD_FIELDS: int = 3  # Generation, ticks and time in front of the parameters
+HEADER_KEYS: tuple = (
+    "inputs",
+    "outputs",
+    "layers",
+    "hidden_activation",
+    "output_activation",
+)
+DELTA_INDEX_DTYPE = numpy.dtype(
+    [
+        ("generation", "<i8"),
+        ("ticks", "<i8"),
+        ("time", "<f8"),
+        ("offset", "<i8"),  # Byte offset of the entry in the delta file
+        ("count", "<i8"),  # Number of stored values
+        ("keyframe", "<i8"),  # Index of the keyframe the entry is based on
+    ]
+)
+
+
+def _map_records(path: str, dtype, shape: tuple = ()):
+    """
+    Returns the complete records of a file as a read-only memory-mapped array.
+    An incomplete last record of an interrupted write is ignored.
+    """
+    dtype = numpy.dtype(dtype)
+    record_bytes = dtype.itemsize * int(numpy.prod(shape))
+    count = os.path.getsize(path) // record_bytes if os.path.isfile(path) else 0
+    if not count:
+        return numpy.zeros((0, *shape), dtype)
+    return numpy.memmap(path, dtype, "r", shape=(count, *shape))
+
+
+def _append_records(path: str, records: numpy.ndarray):
+    """
+    Append records to a file after dropping an incomplete last record.
+    """
+    record_bytes = records[0].nbytes
+    with open(path, "ab") as fp:
+        fp.truncate(fp.tell() - fp.tell() % record_bytes)
+        fp.write(records.tobytes())
+
+
+class _Archive(abc.ABC):
+    """
+    Base class of append-only archives with one record per generation.
+    The network description, which is the same for all records, is stored
+    in a JSON sidecar file.
+    """
+
+    header_file: str = HEADER_FILE
+    files: tuple  # Names of all files of the archive
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.header_path = os.path.join(directory, self.header_file)
+        self.header = None
+        self._read_header()
+
+    def _read_header(self):
+        if os.path.isfile(self.header_path):
+            with open(self.header_path, "r") as fp:
+                self.header = json.load(fp)
+
+    def _write_header(self, data: dict):
+        os.path.isdir(self.directory) or os.makedirs(self.directory)
+
+        header = {key: data[key] for key in HEADER_KEYS}
+        header["layers"] = numpy.asarray(header["layers"]).tolist()
+        header["num_weights"] = len(data["weights"])
+        header["num_biases"] = len(data["biases"])
+
+        with open(self.header_path, "w") as fp:
+            json.dump(header, fp)
+        self.header = header
+
+    def _check_header(self, data: dict):
+        for key in HEADER_KEYS:
+            value = data[key]
+            if key == "layers":
+                value = numpy.asarray(value).tolist()
+            if value != self.header[key]:
+                raise ValueError(f"The {key} do not match the archive: {value}")
+
+    @abc.abstractmethod
+    def _generation_column(self):
+        """
+        Returns the generation numbers of all records.
+        """
+
+    @abc.abstractmethod
+    def reopen(self):
+        """
+        Read the files again after they were replaced.
+        """
+
+    @abc.abstractmethod
+    def load(self, generation: int):
+        """
+        Returns the data of a generation in the format of a JSON save file.
+        Returns None if the generation is not in the archive.
+        """
+
+    @abc.abstractmethod
+    def append(self, *generations: dict):
+        """
+        Append the data of generations in ascending order to the archive.
+        """
+
+    def __len__(self):
+        return len(self._generation_column())
+
+    def generations(self):
+        """
+        Returns an array with the generation numbers of all records.
+        """
+        return numpy.array(self._generation_column(), dtype=int)
+
+    def newest(self):
+        """
+        Returns the newest generation of the archive or -1 if it is empty.
+        """
+        generations = self._generation_column()
+        if not len(generations):
+            return -1
+        return int(generations[-1])
+
+    def _find(self, generation: int):
+        """
+        Returns the index of the record of a generation or -1.
+        """
+        generations = self._generation_column()
+        if not len(generations):
+            return -1
+
+        # Generations are usually saved without gaps
+        index = generation - int(generations[0])
+        if 0 <= index < len(generations) and generations[index] == generation:
+            return index
+
+        index = int(numpy.searchsorted(generations, generation))
+        if index < len(generations) and generations[index] == generation:
+            return index
+        return -1
+
+    def __contains__(self, generation: int):
+        return self._find(generation) != -1
+
+    def _check_order(self, generations: tuple):
+        """
+        Raise a ValueError unless the generations are new and ascending.
+        """
+        last = self.newest()
+        for data in generations:
+            self._check_header(data)
+            if data["generation"] <= last:
+                raise ValueError(
+                    f"Generation {data['generation']} is not newer than {last}"
+                )
+            last = data["generation"]
+
+    def _generation_data(self, generation, ticks, time, parameters):
+        """
+        Returns the data of a generation in the format of a JSON save file.
+        """
+        num_weights = self.header["num_weights"]
+
+        data = {key: self.header[key] for key in HEADER_KEYS}
+        data["layers"] = numpy.array(data["layers"])
+        data["generation"] = generation
+        data["ticks"] = int(ticks)
+        data["time"] = float(time)
+        data["weights"] = parameters[:num_weights]
+        data["biases"] = parameters[num_weights:]
+        return data
+
+
+class GenerationArchive(_Archive):
+    """
+    Append-only file with the weights and biases of many generations.
+    Every generation is stored as a fixed-size record of float64 values:
+    generation, ticks, time, weights and biases.
+    """
+
+    files: tuple = (HEADER_FILE, ARCHIVE_FILE)
+
+    def __init__(self, directory: str):
+        super().__init__(directory)
+        self.path = os.path.join(directory, ARCHIVE_FILE)
+        self._records = None
+        self._mapped_size = -1
+
+    def reopen(self):
+        """
+        Read the files again after they were replaced.
+        """
+        self._read_header()
+        self._records = None
+        self._mapped_size = -1
+
+    @property
+    def record_size(self):
+        return RECORD_FIELDS + self.header["num_weights"] + self.header["num_biases"]
+
+    def _map(self):
+        """
+        Returns the records as a read-only memory-mapped array.
+        The file is mapped again only if its size has changed.
+        """
+        if self.header is None:
+            self._read_header()
+        if self.header is None or not os.path.isfile(self.path):
+            return numpy.zeros((0, 1))
+
+        size = os.path.getsize(self.path)
+        if size != self._mapped_size:
+            self._records = _map_records(self.path, numpy.float64, (self.record_size,))
+            self._mapped_size = size
+
+        return self._records
+
+    def _generation_column(self):
+        return self._map()[:, 0]
+
+    def load(self, generation: int):
+        """
+        Returns the data of a generation in the format of a JSON save file.
+        Returns None if the generation is not in the archive.
+        """
+        index = self._find(generation)
+        if index == -1:
+            return None
+
+        record = numpy.array(self._map()[index])
+        return self._generation_data(
+            generation, record[1], record[2], record[RECORD_FIELDS:]
+        )
+
+    def append(self, *generations: dict):
+        """
+        Append the data of generations in ascending order to the archive.
+        """
+        if not generations:
+            return
+
+        if self.header is None:
+            self._write_header(generations[0])
+        self._check_order(generations)
+
+        records = numpy.zeros((len(generations), self.record_size))
+        for record, data in zip(records, generations):
+            record[0] = data["generation"]
+            record[1] = data["ticks"]
+            record[2] = data["time"]
+            record[RECORD_FIELDS:] = numpy.concatenate(
+                (data["weights"], data["biases"])
+            )
+
+        _append_records(self.path, records)
+
+
+class DeltaArchive(_Archive):
+    """
+    Append-only archive which stores the weights and biases of most
+    generations as the sparse changes to the previously saved generation.
+    Every KEYFRAME_INTERVAL entries, or when most parameters changed, a full
+    keyframe is stored instead. An index file with one fixed-size record
+    per generation points to the entries of the delta file.
+
+    Keyframe entries contain all parameters as float64 values. Delta
+    entries contain the changed values as float64 followed by their
+    indices as int32, padded to a multiple of 8 bytes.
+    """
+
+    header_file: str = DELTA_HEADER_FILE
+    files: tuple = (DELTA_HEADER_FILE, DELTA_FILE, DELTA_INDEX_FILE)
+
+    def __init__(self, directory: str, keyframe_interval: int = KEYFRAME_INTERVAL):
+        super().__init__(directory)
+        self.path = os.path.join(directory, DELTA_FILE)
+        self.index_path = os.path.join(directory, DELTA_INDEX_FILE)
+        self.keyframe_interval = keyframe_interval
+        self._index = numpy.zeros(0, DELTA_INDEX_DTYPE)
+        self._mapped_size = -1
+        self._data = None
+        self._data_size = -1
+        self._last_parameters = None  # Parameters of the newest entry
+
+    def reopen(self):
+        """
+        Read the files again after they were replaced.
+        """
+        self._read_header()
+        self._index = numpy.zeros(0, DELTA_INDEX_DTYPE)
+        self._mapped_size = -1
+        self._data = None
+        self._data_size = -1
+        self._last_parameters = None
+
+    def _map_index(self):
+        if self.header is None:
+            self._read_header()
+
+        size = -1
+        if self.header is not None and os.path.isfile(self.index_path):
+            size = os.path.getsize(self.index_path)
+        if size != self._mapped_size:
+            if size > 0:
+                self._index = _map_records(self.index_path, DELTA_INDEX_DTYPE)
+            else:
+                self._index = numpy.zeros(0, DELTA_INDEX_DTYPE)
+            self._mapped_size = size
+
+        return self._index
+
+    def _map_data(self):
+        size = os.path.getsize(self.path)
+        if size != self._data_size:
+            self._data = numpy.memmap(self.path, numpy.uint8, "r")
+            self._data_size = size
+        return self._data
+
+    def _generation_column(self):
+        return self._map_index()["generation"]
+
+    def _read_entry(self, entry):
+        """
+        Returns the values and indices of an entry of the delta file.
+        The indices are None for keyframes.
+        """
+        data = self._map_data()
+        offset = int(entry["offset"])
+        count = int(entry["count"])
+
+        if not count:
+            return numpy.zeros(0), numpy.zeros(0, numpy.int32)
+
+        values = numpy.frombuffer(data, numpy.float64, count, offset)
+        if entry["keyframe"] == -1:
+            return values, None
+        indices = numpy.frombuffer(data, numpy.int32, count, offset + 8 * count)
+        return values, indices
+
+    def _parameters(self, index: int):
+        """
+        Returns the parameters of an entry by replaying the deltas since
+        its keyframe.
+        """
+        entries = self._map_index()
+        keyframe = int(entries[index]["keyframe"])
+        if keyframe == -1:
+            keyframe = index
+
+        parameters = numpy.array(self._read_entry(entries[keyframe])[0])
+        for entry in entries[keyframe + 1 : index + 1]:
+            values, indices = self._read_entry(entry)
+            parameters[indices] = values
+
+        return parameters
+
+    def load(self, generation: int):
+        """
+        Returns the data of a generation in the format of a JSON save file.
+        Returns None if the generation is not in the archive.
+        """
+        index = self._find(generation)
+        if index == -1:
+            return None
+
+        entry = self._map_index()[index]
+        return self._generation_data(
+            generation, entry["ticks"], entry["time"], self._parameters(index)
+        )
+
+    def append(self, *generations: dict):
+        """
+        Append the data of generations in ascending order to the archive.
+        """
+        if not generations:
+            return
+
+        if self.header is None:
+            self._write_header(generations[0])
+        self._check_order(generations)
+
+        entries = self._map_index()
+        count = len(entries)
+        if self._last_parameters is None and count:
+            self._last_parameters = self._parameters(count - 1)
+        last_keyframe = -1
+        if count:
+            last_keyframe = int(entries[-1]["keyframe"])
+            last_keyframe = count - 1 if last_keyframe == -1 else last_keyframe
+
+        offset = os.path.getsize(self.path) if os.path.isfile(self.path) else 0
+        index = numpy.zeros(len(generations), DELTA_INDEX_DTYPE)
+        chunks = []
+
+        for i, data in enumerate(generations):
+            parameters = numpy.concatenate((data["weights"], data["biases"]))
+            parameters = parameters.astype(numpy.float64)
+            entry = index[i]
+            entry["generation"] = data["generation"]
+            entry["ticks"] = data["ticks"]
+            entry["time"] = data["time"]
+            entry["offset"] = offset
+
+            changed = None
+            if self._last_parameters is not None:
+                changed = numpy.flatnonzero(parameters != self._last_parameters)
+
+            if (
+                changed is None
+                or count + i - last_keyframe >= self.keyframe_interval
+                or len(changed) * 12 >= len(parameters) * 8
+            ):
+                # Keyframe
+                entry["count"] = len(parameters)
+                entry["keyframe"] = -1
+                last_keyframe = count + i
+                chunk = parameters.tobytes()
+            else:
+                entry["count"] = len(changed)
+                entry["keyframe"] = last_keyframe
+                chunk = parameters[changed].tobytes()
+                chunk += changed.astype(numpy.int32).tobytes()
+                chunk += bytes(-len(chunk) % 8)
+
+            chunks.append(chunk)
+            offset += len(chunk)
+            self._last_parameters = parameters
+
+        # Write the entries before the index that points to them
+        with open(self.path, "ab") as fp:
+            fp.write(b"".join(chunks))
+        _append_records(self.index_path, index)
+
+
+def _json_generations(directory: str):
+    """
+    Returns the sorted generation numbers of the genN.json files of a directory.
+    """
+    generations = []
+    for name in os.listdir(directory):
+        if not (name.startswith("gen") and name.endswith(".json")):
+            continue
+        try:
+            generations.append(int(name[3:-5]))
+        except ValueError:
+            continue
+    return sorted(generations)
+
+
+def _append_generations(archive: _Archive, generations: list, load):
+    """
+    Append the data of generations, returned by load, in batches.
+    """
+    batch = []
+    for generation in generations:
+        batch.append(load(generation))
+        if len(batch) == 1000:
+            archive.append(*batch)
+            batch = []
+    archive.append(*batch)
+
+
+def import_json_generations(directory: str, archive: _Archive = None):
+    """
+    Add all genN.json files of a directory that are not archived yet to the
+    archive. Newer generations are appended. If some are older than the
+    newest archived generation, e.g. because training saved to the archive
+    before the import, the archive is rebuilt in a temporary directory with
+    all generations and then replaces the old files.
+    Returns the number of imported generations.
+    """
+    if archive is None:
+        archive = GenerationArchive(directory)
+
+    def load_json(generation):
+        with open(os.path.join(directory, f"gen{generation}.json"), "r") as fp:
+            return json.load(fp)
+
+    generations = [g for g in _json_generations(directory) if g not in archive]
+    if not generations or generations[0] > archive.newest():
+        _append_generations(archive, generations, load_json)
+        return len(generations)
+
+    imported = set(generations)
+    generations = sorted(imported.union(archive.generations().tolist()))
+
+    def load(generation):
+        if generation in imported:
+            return load_json(generation)
+        return archive.load(generation)
+
+    with tempfile.TemporaryDirectory(dir=directory) as temporary:
+        rebuilt = type(archive)(temporary)
+        if isinstance(archive, DeltaArchive):
+            rebuilt.keyframe_interval = archive.keyframe_interval
+        _append_generations(rebuilt, generations, load)
+        for name in type(archive).files:
+            os.replace(os.path.join(temporary, name), os.path.join(directory, name))
+    archive.reopen()
+
+    return len(imported)
+
+
+def main():
+    directory = argv("dir", abspath("gen"))
+    if argv("format", "archive") == "delta":
+        archive = DeltaArchive(directory)
+    else:
+        archive = GenerationArchive(directory)
+
+    count = import_json_generations(directory, archive)
+    print(f"Imported {count} generations into {archive.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+from pendulum import Pendulum
+from util import Vec, argv
+from unittest import mock
+import contextlib
+import tempfile
+import platform
+import timeit
+import train
+import numpy
+import json
+import time
+import sys
+import ai
+
+
+REPEAT = argv("repeat", 7)
+NUMBER = argv("number", 20000)
+SUITES = argv("suites", "pendulum,agent,episode,iterate,checkpoint")
+AGENTS = argv("agents", "10,50")  # num_agents values of the iterate suite
+WORKERS = argv("workers", "1,4")  # NUM_WORKERS values of the iterate suite
+GENERATIONS = argv("generations", 2)  # Measured generations per configuration
+OUTPUT = argv("output", "")  # JSON file for the results
+COMPARE = argv("compare", "")  # JSON file of a baseline
+TOLERANCE = argv("tolerance", 0.1)  # Allowed slowdown against the baseline
+
+# Units of the rates printed next to the seconds of each benchmark
+RATE_UNITS: dict = {
+    "pendulum_update": "ticks",
+    "pendulum_step": "ticks",
+    "agent_run": "calls",
+    "agent_forward": "calls",
+}
+
+
+def measure(func, number=NUMBER, repeat=REPEAT):
+    """
+    Returns the fastest time of a single call to func in seconds.
+    """
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def example_agent():
+    """
+    Returns an agent with random weights and the layers used by train.py.
+    """
+    layers = numpy.array([5, 10, 10, 1])
+    rng = numpy.random.default_rng(0)
+    weights = rng.uniform(-1, 1, sum(layers[1:] * layers[:-1]))
+    biases = rng.uniform(-1, 1, sum(layers[1:]))
+    tanh = ai.ActivationFunction.tanh
+    return ai.Agent(layers, weights, biases, tanh, tanh, 0)
+
+
+@contextlib.contextmanager
+def generation_directory():
+    """
+    Let ai save generations to a temporary directory. Its cached archives
+    are removed with it.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            with mock.patch.object(ai, "GENERATION_DIRECTORY", directory):
+                with mock.patch.object(ai, "PRINT_RESULTS", False):
+                    yield directory
+        finally:
+            ai._archive_cache.pop(directory, None)
+
+
+def benchmark_pendulum():
+    pendulum = Pendulum()
+
+    def update():
+        pendulum.apply_acceleration(Vec(1, 0))
+        pendulum.update()
+
+    step_pendulum = Pendulum()
+
+    def step():
+        step_pendulum.step(1)
+
+    return {"pendulum_update": measure(update), "pendulum_step": measure(step)}
+
+
+def benchmark_agent_run():
+    agent = example_agent()
+    values = [0.1, -0.2, 0.3, 0.9, -1.5]
+    inputs = numpy.array(values)
+
+    return {
+        "agent_run": measure(lambda: agent.run(*values)),
+        "agent_forward": measure(lambda: agent.forward(inputs)),
+    }
+
+
+def benchmark_episode():
+    """
+    Wall time of one full episode of train.train.
+    """
+
+    def episode():
+        agent = example_agent()
+        train.train(agent)
+
+    return {"train_episode": measure(episode, 1, min(REPEAT, 3))}
+
+
+def benchmark_iterate():
+    """
+    Wall time per generation of ReinforcementLearningModel._iterate.
+    """
+    results = {}
+
+    for num_agents in map(int, AGENTS.split(",")):
+        for workers in map(int, WORKERS.split(",")):
+            with mock.patch.object(ai, "NUM_WORKERS", workers), generation_directory():
+                model = ai.ReinforcementLearningModel(
+                    func=train.train,
+                    num_agents=num_agents,
+                    inputs=train.INPUTS,
+                    outputs=train.OUTPUTS,
+                    hidden=train.HIDDEN,
+                    hidden_activation="tanh",
+                    output_activation="tanh",
+                )
+                with model._create_executor() as executor:
+                    model.data["generation"] += 1
+                    model._iterate(executor)  # Start the worker processes
+
+                    start = time.perf_counter()
+                    for _ in range(GENERATIONS):
+                        model.data["generation"] += 1
+                        model._iterate(executor)
+                    seconds = (time.perf_counter() - start) / GENERATIONS
+                model.checkpoints.flush()
+
+            results[f"iterate_agents{num_agents}_workers{workers}"] = seconds
+
+    return results
+
+
+def benchmark_checkpoint():
+    """
+    Latency of saving and loading a generation in every save format.
+    """
+    results = {}
+    agent = example_agent()
+    data = {
+        "generation": 0,
+        "inputs": train.INPUTS,
+        "outputs": train.OUTPUTS,
+        "layers": agent.layers,
+        "hidden_activation": "tanh",
+        "output_activation": "tanh",
+        "ticks": 0,
+        "time": 0.0,
+        "weights": numpy.concatenate([weights.ravel() for weights in agent.weights]),
+        "biases": numpy.concatenate(agent.biases),
+    }
+
+    for save_format in ("archive", "delta", "json"):
+        with mock.patch.object(ai, "SAVE_FORMAT", save_format), generation_directory():
+            start = time.perf_counter()
+            for generation in range(NUMBER // 100):
+                data["generation"] = generation
+                ai.save_generation_data(data)
+            save = (time.perf_counter() - start) / (NUMBER // 100)
+
+            load = measure(lambda: ai._load_generation(), NUMBER // 100)
+
+        results[f"save_generation_{save_format}"] = save
+        results[f"load_generation_{save_format}"] = load
+
+    return results
+
+
+SUITE_FUNCTIONS: dict = {
+    "pendulum": benchmark_pendulum,
+    "agent": benchmark_agent_run,
+    "episode": benchmark_episode,
+    "iterate": benchmark_iterate,
+    "checkpoint": benchmark_checkpoint,
+}
+
+
+def compare(results: dict, baseline: dict, tolerance: float = TOLERANCE):
+    """
+    Returns the names of the results that are slower than the baseline by
+    more than the tolerance, with the ratio of their times.
+    """
+    regressions = {}
+    for name, seconds in results.items():
+        if name in baseline and seconds > baseline[name] * (1 + tolerance):
+            regressions[name] = seconds / baseline[name]
+    return regressions
+
+
+def main():
+    results = {}
+    for suite in SUITES.split(","):
+        results.update(SUITE_FUNCTIONS[suite]())
+
+    baseline = {}
+    if COMPARE:
+        with open(COMPARE, "r") as fp:
+            baseline = json.load(fp)["results"]
+    regressions = compare(results, baseline)
+
+    for name, seconds in results.items():
+        line = f"{name}: {seconds * 1e6:.3f} us"
+        if name in RATE_UNITS:
+            line += f" ({1 / seconds:,.0f} {RATE_UNITS[name]}/s)"
+        if name in baseline:
+            line += f"; baseline: {baseline[name] * 1e6:.3f} us"
+        if name in regressions:
+            line += f"; REGRESSION x{regressions[name]:.2f}"
+        print(line)
+
+    if OUTPUT:
+        with open(OUTPUT, "w") as fp:
+            json.dump(
+                {
+                    "results": results,
+                    "python": platform.python_version(),
+                    "numpy": numpy.__version__,
+                    "machine": platform.machine(),
+                    "time": time.time(),
+                },
+                fp,
+                indent=4,
+            )
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+from util import argv
+import pygame.freetype
+import collections
+import pygame
+import json
+import os
+
+
+FPS = 10
+WIDTH = 800
+HEIGHT = 450
+MARGIN = 40
+FILE = argv("file", "telemetry.jsonl")  # Written by train.py --telemetry
+HISTORY = argv("history", 1000)  # Generations kept and plotted
+TAIL_BLOCK = 1 << 16  # Bytes read at once when searching the last lines
+
+WHITE = (200, 200, 200)
+GRAY = (100, 100, 100)
+BLACK = (0, 0, 0)
+GREEN = (100, 200, 100)
+RED = (200, 100, 100)
+
+# Plotted stats with their colors
+LINES: dict = {
+    "best": GREEN,
+    "median": WHITE,
+    "worst": RED,
+}
+
+
+class TelemetryReader:
+    """
+    Follows a telemetry file of ai.TelemetryStream and keeps the newest
+    records. The first read starts at the last history lines of the file,
+    later reads only parse the bytes appended since.
+    """
+
+    def __init__(self, file_name: str, history: int = HISTORY):
+        self.file_name = file_name
+        self.records = collections.deque(maxlen=history)
+        self._position = 0
+        self._partial = b""
+        self._opened = False  # Whether the start of the tail was found
+
+    def _tail(self, fp, size: int):
+        """
+        Returns the offset of the first of the last history lines of a file.
+        """
+        remaining = self.records.maxlen + 1  # Newlines up to that offset
+        position = size
+        while position > 0:
+            start = max(position - TAIL_BLOCK, 0)
+            fp.seek(start)
+            block = fp.read(position - start)
+            end = len(block)
+            while remaining:
+                end = block.rfind(b"\n", 0, end)
+                if end == -1:
+                    break
+                remaining -= 1
+            if not remaining:
+                return start + end + 1
+            position = start
+        return 0
+
+    def read(self):
+        """
+        Returns the number of new records.
+        """
+        try:
+            size = os.path.getsize(self.file_name)
+        except OSError:
+            return 0
+
+        if size < self._position:  # The file was truncated or replaced
+            self.records.clear()
+            self._position = 0
+            self._partial = b""
+            self._opened = False
+
+        with open(self.file_name, "rb") as fp:
+            if not self._opened:
+                self._position = self._tail(fp, size)
+                self._opened = True
+            fp.seek(self._position)
+            data = self._partial + fp.read()
+            self._position = fp.tell()
+
+        *lines, self._partial = data.split(b"\n")
+        count = 0
+        for line in lines:
+            try:
+                self.records.append(json.loads(line))
+                count += 1
+            except ValueError:
+                pass
+        return count
+
+
+class Window:
+    def __init__(self):
+        self.reader = TelemetryReader(FILE)
+
+        pygame.init()
+        self.window = pygame.display.set_mode((WIDTH, HEIGHT))
+        pygame.display.set_caption("Training monitor")
+        self.clock = pygame.time.Clock()
+        self.font = pygame.freetype.SysFont(None, 14)
+
+    def update(self):
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                pygame.quit()
+                raise SystemExit
+
+        self.reader.read()
+
+        self.window.fill(BLACK)
+        self.draw_plot()
+        self.draw_info()
+
+        pygame.display.flip()
+        self.clock.tick(FPS)
+
+    def draw_plot(self):
+        records = self.reader.records
+        left, top = MARGIN, MARGIN
+        width, height = WIDTH - 2 * MARGIN, HEIGHT - 3 * MARGIN
+        pygame.draw.rect(self.window, GRAY, (left, top, width, height), 1)
+
+        if len(records) < 2:
+            return
+
+        values = [record[name] for record in records for name in LINES]
+        low, high = min(values), max(values)
+        scale = height / (high - low or 1)
+        step = width / (len(records) - 1)
+
+        for name, color in LINES.items():
+            points = [
+                (left + i * step, top + height - (record[name] - low) * scale)
+                for i, record in enumerate(records)
+            ]
+            pygame.draw.aalines(self.window, color, False, points)
+
+        self.font.render_to(self.window, (left, top - 15), f"{high:.0f}", WHITE)
+        self.font.render_to(self.window, (left, top + height + 5), f"{low:.0f}", WHITE)
+
+    def draw_info(self):
+        if not self.reader.records:
+            text = f"Waiting for {FILE}"
+            self.font.render_to(self.window, (MARGIN, HEIGHT - 60), text, WHITE)
+            return
+
+        record = self.reader.records[-1]
+        texts = (
+            f"Generation: {record['generation']}; "
+            f"Generations/s: {record['generations_per_second']:.2f}; "
+            f"Ticks: {record['ticks']}",
+            "; ".join(f"{name.capitalize()}: {record[name]:.0f}" for name in LINES),
+        )
+
+        for i, text in enumerate(texts):
+            position = (MARGIN, HEIGHT - 60 + 20 * i)
+            self.font.render_to(self.window, position, text, WHITE if i == 0 else GRAY)
+
+
+def main():
+    window = Window()
+    while True:
+        window.update()
+
+
+if __name__ == "__main__":
+    main()
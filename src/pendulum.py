@@ -1,8 +1,46 @@
 from util import Vec
+import numpy
 import math
 
 
-DELTA_TIME = 1 / 60  # Uncontrolled delta_time leads to uninterntional behaviour
+DELTA_TIME = 1 / 60  # Length of a tick; Pendulum.step splits longer steps into substeps
+INTEGRATORS: tuple = ("semi-implicit", "rk4")
+
+
+def rk4(pendulum, acceleration_x, delta_time: float, lib=math):
+    """
+    Returns x, angle, angular velocity and horizontal velocity after a
+    Runge-Kutta step with a constant acceleration of the cart, ignoring the
+    rail. The derivatives are the limit of the semi-implicit update for
+    small steps, where damping acts in both calls of accelerate per tick.
+    Works for Pendulum and, with lib=numpy, for PendulumBatch.
+    """
+    angular_damping = 2 * pendulum.angular_damping
+    horizontal_damping = 2 * pendulum.horizontal_damping
+    horizontal_velocity = pendulum.horizontal_velocity
+
+    def derivatives(angle, angular_velocity, velocity):
+        """
+        Returns the derivatives of angle, angular velocity, x and velocity.
+        """
+        angular_acceleration = acceleration_x * lib.sin(angle)
+        angular_acceleration += pendulum.gravity * lib.cos(angle)
+        angular_acceleration /= pendulum.radius
+        angular_acceleration -= angular_damping * angular_velocity
+        acceleration = acceleration_x - horizontal_damping * velocity
+        return angular_velocity, angular_acceleration, velocity, acceleration
+
+    state = (pendulum.angle, pendulum.angular_velocity, pendulum.x, horizontal_velocity)
+    k1 = derivatives(state[0], state[1], state[3])
+    k2 = derivatives(*[state[i] + k1[i] * delta_time / 2 for i in (0, 1, 3)])
+    k3 = derivatives(*[state[i] + k2[i] * delta_time / 2 for i in (0, 1, 3)])
+    k4 = derivatives(*[state[i] + k3[i] * delta_time for i in (0, 1, 3)])
+
+    angle, angular_velocity, x, horizontal_velocity = [
+        state[i] + (k1[i] + 2 * k2[i] + 2 * k3[i] + k4[i]) * delta_time / 6
+        for i in range(4)
+    ]
+    return x, angle, angular_velocity, horizontal_velocity
 
 
 class Pendulum:
@@ -15,33 +53,47 @@ class Pendulum:
         self.mass = 1
 
         self.angular_damping = 0.1
-        self.horizontal_daming = 0.3
+        self.horizontal_damping = 0.3
         self.gravity = 9.81
 
+        self.integrator = "semi-implicit"  # Used by step, one of INTEGRATORS
+        self.substeps = 1  # Integrator steps per step
+
     def apply_acceleration(self, acceleration: Vec):
-        if acceleration.x < 0 and self.x <= -1 or acceleration.x > 0 and self.x >= 1:
-            acceleration.x = 0
+        self.accelerate(acceleration.x, acceleration.y)
+
+    def accelerate(
+        self, acceleration_x: float, acceleration_y: float = 0, delta_time=DELTA_TIME
+    ):
+        """
+        apply_acceleration without Vec objects. The arithmetic is the same,
+        operation by operation, so the results are identical.
+        """
+        if acceleration_x < 0 and self.x <= -1 or acceleration_x > 0 and self.x >= 1:
+            acceleration_x = 0
 
         # Rotational movement
-        force: Vec = acceleration * self.mass
+        force_x = acceleration_x * self.mass
+        force_y = acceleration_y * self.mass
         moment_of_inertia = self.mass * self.radius**2
         angular_acceleration = (
-            force.cross(Vec.from_angle(self.angle) * self.radius) / moment_of_inertia
-        )
+            force_x * (math.sin(self.angle) * self.radius)
+            - force_y * (math.cos(self.angle) * self.radius)
+        ) / moment_of_inertia
 
         angular_acceleration -= self.angular_damping * self.angular_velocity
-        self.angular_velocity += angular_acceleration * DELTA_TIME
+        self.angular_velocity += angular_acceleration * delta_time
 
         # Horizontal movement
-        acceleration.x -= self.horizontal_damping * self.horizontal_velocity
-        self.horizontal_velocity += acceleration.x * DELTA_TIME
+        acceleration_x -= self.horizontal_damping * self.horizontal_velocity
+        self.horizontal_velocity += acceleration_x * delta_time
 
-    def update_velocity(self):
+    def update_velocity(self, delta_time: float = DELTA_TIME):
         # Rotational movement
-        self.angle += self.angular_velocity * DELTA_TIME
+        self.angle += self.angular_velocity * delta_time
 
         # Horizontal movement
-        self.x += self.horizontal_velocity * DELTA_TIME
+        self.x += self.horizontal_velocity * delta_time
         if self.x < -1:
             self.x = -1
             self.horizontal_velocity = 0
@@ -50,5 +102,142 @@ class Pendulum:
             self.horizontal_velocity = 0
 
     def update(self):
-        self.apply_acceleration(Vec(0, -self.gravity))
+        self.accelerate(0, -self.gravity)
+        self.update_velocity()
+
+    def step(self, acceleration_x: float, delta_time: float = DELTA_TIME):
+        """
+        Advance by delta_time with a constant acceleration of the cart, in
+        self.substeps steps of self.integrator. With the defaults, this is
+        the same as apply_acceleration(Vec(acceleration_x, 0)) and update().
+        """
+        delta_time /= self.substeps
+        if self.integrator == "rk4":
+            for _ in range(self.substeps):
+                self._step_rk4(acceleration_x, delta_time)
+            return
+        if self.integrator != "semi-implicit":
+            raise ValueError(f"Unknown integrator: {self.integrator}")
+
+        for _ in range(self.substeps):
+            self.accelerate(acceleration_x, 0, delta_time)
+            self.accelerate(0, -self.gravity, delta_time)
+            self.update_velocity(delta_time)
+
+    def _step_rk4(self, acceleration_x: float, delta_time: float):
+        if acceleration_x < 0 and self.x <= -1 or acceleration_x > 0 and self.x >= 1:
+            acceleration_x = 0
+
+        state = rk4(self, acceleration_x, delta_time)
+        self.x, self.angle, self.angular_velocity, self.horizontal_velocity = state
+        if abs(self.x) > 1:
+            self.x = math.copysign(1, self.x)
+            self.horizontal_velocity = 0
+
+
+class PendulumBatch:
+    """
+    Simulates n independent pendulums at once.
+    Every attribute of Pendulum is stored as an array of length n and
+    each method performs the same arithmetic as its Pendulum counterpart.
+    """
+
+    def __init__(self, n: int):
+        self.n = n
+        self.x = numpy.zeros(n)
+        self.angle = numpy.full(n, math.pi / 2)
+        self.angular_velocity = numpy.zeros(n)
+        self.horizontal_velocity = numpy.zeros(n)
+        self.radius = 0.5
+        self.mass = 1
+
+        self.angular_damping = numpy.full(n, 0.1)
+        self.horizontal_damping = numpy.full(n, 0.3)
+        self.gravity = numpy.full(n, 9.81)
+
+        self.integrator = "semi-implicit"
+        self.substeps = 1
+
+    def apply_acceleration(
+        self, acceleration_x, acceleration_y=0.0, where=None, delta_time=DELTA_TIME
+    ):
+        """
+        Apply an acceleration to every cart, or only where a mask is True.
+        Both components may be scalars or arrays of length n.
+        """
+        acceleration_x = numpy.broadcast_to(acceleration_x, (self.n,))
+        blocked = (acceleration_x < 0) & (self.x <= -1)
+        blocked |= (acceleration_x > 0) & (self.x >= 1)
+        acceleration_x = numpy.where(blocked, 0.0, acceleration_x)
+
+        # Rotational movement
+        force_x = acceleration_x * self.mass
+        force_y = numpy.multiply(acceleration_y, self.mass)
+        moment_of_inertia = self.mass * self.radius**2
+        angular_acceleration = (
+            force_x * (numpy.sin(self.angle) * self.radius)
+            - force_y * (numpy.cos(self.angle) * self.radius)
+        ) / moment_of_inertia
+
+        angular_acceleration -= self.angular_damping * self.angular_velocity
+        if where is not None:
+            angular_acceleration = numpy.where(where, angular_acceleration, 0.0)
+        self.angular_velocity += angular_acceleration * delta_time
+
+        # Horizontal movement
+        acceleration_x -= self.horizontal_damping * self.horizontal_velocity
+        if where is not None:
+            acceleration_x = numpy.where(where, acceleration_x, 0.0)
+        self.horizontal_velocity += acceleration_x * delta_time
+
+    def update_velocity(self, delta_time: float = DELTA_TIME):
+        # Rotational movement
+        self.angle += self.angular_velocity * delta_time
+
+        # Horizontal movement
+        self.x += self.horizontal_velocity * delta_time
+        outside = (self.x < -1) | (self.x > 1)
+        numpy.clip(self.x, -1, 1, out=self.x)
+        self.horizontal_velocity[outside] = 0
+
+    def update(self):
+        self.apply_acceleration(0.0, -self.gravity)
         self.update_velocity()
+
+    def step(self, acceleration_x, delta_time: float = DELTA_TIME):
+        delta_time /= self.substeps
+        if self.integrator == "rk4":
+            for _ in range(self.substeps):
+                self._step_rk4(acceleration_x, delta_time)
+            return
+        if self.integrator != "semi-implicit":
+            raise ValueError(f"Unknown integrator: {self.integrator}")
+
+        for _ in range(self.substeps):
+            self.apply_acceleration(acceleration_x, 0.0, None, delta_time)
+            self.apply_acceleration(0.0, -self.gravity, None, delta_time)
+            self.update_velocity(delta_time)
+
+    def _step_rk4(self, acceleration_x, delta_time: float):
+        acceleration_x = numpy.broadcast_to(acceleration_x, (self.n,))
+        blocked = (acceleration_x < 0) & (self.x <= -1)
+        blocked |= (acceleration_x > 0) & (self.x >= 1)
+        acceleration_x = numpy.where(blocked, 0.0, acceleration_x)
+
+        state = rk4(self, acceleration_x, delta_time, numpy)
+        self.x, self.angle, self.angular_velocity, self.horizontal_velocity = state
+        self.horizontal_velocity[numpy.abs(self.x) > 1] = 0
+        numpy.clip(self.x, -1, 1, out=self.x)
+
+    def keep(self, mask):
+        """
+        Remove every pendulum where mask is False.
+        """
+        self.n = int(numpy.count_nonzero(mask))
+        self.x = self.x[mask]
+        self.angle = self.angle[mask]
+        self.angular_velocity = self.angular_velocity[mask]
+        self.horizontal_velocity = self.horizontal_velocity[mask]
+        self.angular_damping = self.angular_damping[mask]
+        self.horizontal_damping = self.horizontal_damping[mask]
+        self.gravity = self.gravity[mask]
@@ -20,7 +20,7 @@ class Window:
             "angular-damping", self.pendulum.angular_damping
         )
         self.pendulum.horizontal_damping = argv(
-            "horizontal-damping", self.pendulum.horizontal_daming
+            "horizontal-damping", self.pendulum.horizontal_damping
         )
         self.pendulum.gravity = argv("gravity", self.pendulum.gravity)
 
@@ -2,42 +2,144 @@ from pendulum import Pendulum
 from util import Vec, argv
 import pygame.freetype
 import pygame.gfxdraw
+import threading
 import pygame
+import reward
+import train
+import numpy
+import queue
 import math
+import time
 import ai
+import os
 
 
 FPS = 60
 WIDTH = 540
 HEIGHT = 675
 GENERATION = argv("gen", -1)
+SPEED = argv("speed", 1.0)  # Simulated seconds per second, 0 for as fast as possible
+RENDER_EVERY = argv("render-every", 0)  # Ticks per frame, 0 for FPS frames per second
+HEADLESS = argv("headless", False)  # Without a window, using SDL's dummy video driver
+DURATION = argv("duration", 0.0)  # Simulated seconds before exiting, 0 for no limit
+EXPORT = argv("export", "")  # Raw RGB24 video file (.rgb) or directory of images
+IMAGE_FORMAT = argv("image-format", "bmp")  # "bmp", "png", "tga" or "jpg"; png is slow
+SEED = argv("seed", -1)  # Episode of train.py, see its --random-start and --distract
+EXPORT_QUEUE_SIZE: int = 16  # Frames that wait for the writer at most
 
 WHITE = (200, 200, 200)
 GRAY = (100, 100, 100)
 BLACK = (0, 0, 0)
 
 
+class FrameWriter:
+    """
+    Writes frames on a background thread, to one raw RGB24 file if the path
+    ends with ".rgb", otherwise as numbered images to a directory.
+    write blocks while EXPORT_QUEUE_SIZE frames are waiting, so no frame
+    is lost and the memory stays bounded.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        image_format: str = IMAGE_FORMAT,
+        queue_size: int = EXPORT_QUEUE_SIZE,
+    ):
+        self.path = path
+        self.image_format = image_format
+        self.frames = 0
+        self.error = None
+        self.raw = path.endswith(".rgb")
+        if self.raw:
+            self._file = open(path, "wb")
+        else:
+            os.makedirs(path, exist_ok=True)
+
+        # Buffers go from _free to _pending and back after being written
+        self._free = queue.Queue()
+        for _ in range(max(queue_size, 1)):
+            self._free.put(numpy.empty((HEIGHT, WIDTH, 3), numpy.uint8))
+        self._pending = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self, surface: pygame.Surface):
+        buffer = self._free.get()
+        pixels = pygame.surfarray.pixels3d(surface)  # Locks the surface
+        numpy.copyto(buffer, pixels.swapaxes(0, 1))
+        del pixels
+        self._pending.put(buffer)
+
+    def close(self):
+        """
+        Wait for all frames to be written.
+        """
+        self._pending.put(None)
+        self._thread.join()
+        if self.raw:
+            self._file.close()
+        if self.error is not None:
+            raise self.error
+
+    def _run(self):
+        while (buffer := self._pending.get()) is not None:
+            try:
+                if self.raw:
+                    self._file.write(buffer.data)
+                else:
+                    image = pygame.image.frombuffer(buffer.data, (WIDTH, HEIGHT), "RGB")
+                    file_name = f"frame{self.frames:06d}.{self.image_format}"
+                    file_name = os.path.join(self.path, file_name)
+                    pygame.image.save(image, file_name)
+                self.frames += 1
+            except Exception as error:
+                self.error = self.error or error
+            finally:
+                self._free.put(buffer)
+
+
 class Window:
     def __init__(self):
         self.agent: ai.Agent = ai.Agent.load(GENERATION)
         self.ai_enabled = True
+        self.ai_inputs = numpy.zeros(self.agent.layers[0])
 
         self.pendulum = Pendulum()
         self.pendulum.angular_damping = argv(
             "angular-damping", self.pendulum.angular_damping
         )
         self.pendulum.horizontal_damping = argv(
-            "horizontal-damping", self.pendulum.horizontal_daming
+            "horizontal-damping", self.pendulum.horizontal_damping
         )
         self.pendulum.gravity = argv("gravity", self.pendulum.gravity)
 
+        # Start state and distraction, as in train.py
+        self.episode = train.episode(SEED) if SEED >= 0 else (None, -1, 0)
+        if self.episode[0]:
+            self.pendulum.x, self.pendulum.angle = self.episode[0]
+
+        self.ticks = 0
+        self.score = 0
+        self.last_output = 0
+        self.pending_ticks = 0.0  # Fractional ticks that are due at SPEED
+        self.start_time = time.perf_counter()
+
+        if EXPORT and not DURATION:
+            raise SystemExit("--export needs a --duration")
+        self.writer = FrameWriter(EXPORT) if EXPORT else None
+
+        if HEADLESS or EXPORT:
+            os.environ["SDL_VIDEODRIVER"] = "dummy"
         pygame.init()
         self.window = pygame.display.set_mode((WIDTH, HEIGHT))
         self.clock = pygame.time.Clock()
         self.font = pygame.freetype.SysFont(None, 14)
 
-        self.real_time = ai.seconds_to_str(self.agent.time)
-        self.virtual_time = ai.seconds_to_str(self.agent.ticks / 60)
+        # Everything that only changes with the agent, see draw_background
+        self.background = pygame.Surface((WIDTH, HEIGHT)).convert()
+        self.background_agent = None
+        self.neuron_positions = []
 
         self.center = Vec(WIDTH // 2, HEIGHT * 2 // 3)
         self.unit_length = abs(WIDTH // 8 - WIDTH // 2)
@@ -52,45 +154,143 @@ class Window:
                 self.pendulum.apply_acceleration(Vec(acceleration, 0))
             elif event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_r:  # Reset
-                    self.pendulum = Pendulum()
+                    self.reset()
                 elif event.key == pygame.K_t:  # Toggle ai
                     self.ai_enabled = not self.ai_enabled
 
+        # Like the original loop, a frame shows the state before its ticks:
+        # exported frame n shows tick n * ticks per frame, frame 0 the start
         self.draw()
-        self.forward_ai()
-        self.pendulum.update()
+        if self.writer is not None:
+            self.writer.write(self.window)
+        self.simulate()
 
         pygame.display.flip()
-        self.clock.tick(FPS)
-        self.window.fill(BLACK)
+        if self.writer is None:  # Exports run as fast as possible
+            if RENDER_EVERY and SPEED:
+                self.clock.tick(60 * SPEED / RENDER_EVERY)
+            elif SPEED:
+                self.clock.tick(FPS)
+
+    def simulate(self):
+        """
+        Simulate the ticks until the next frame: RENDER_EVERY ticks, the
+        ticks of 1 / FPS seconds at SPEED, or as many as possible within
+        1 / FPS seconds. Exported frames never depend on the wall time.
+        """
+        if RENDER_EVERY or self.writer is not None:
+            ticks = RENDER_EVERY or 60 // FPS
+        elif SPEED:
+            self.pending_ticks += SPEED * 60 / FPS
+            ticks = int(self.pending_ticks)
+            self.pending_ticks -= ticks
+        else:
+            deadline = time.perf_counter() + 1 / FPS
+            while time.perf_counter() < deadline:
+                self.tick()
+            return
 
-    def draw(self):
-        # Draw rail
-        self.draw_rail()
+        for _ in range(ticks):
+            self.tick()
+
+    def tick(self):
+        output = self.forward_ai()
+        self.pendulum.update()
+        self.ticks += 1
+
+        if self.ticks == self.episode[1]:
+            self.pendulum.accelerate(self.episode[2])
+
+        self.score = reward.score_tick(
+            self.score,
+            self.pendulum.x,
+            self.pendulum.angle,
+            output,
+            self.last_output,
+            self.ticks,
+        )
+        self.last_output = output
+
+        if DURATION and self.ticks >= DURATION * 60:
+            self.finish()
+
+    def finish(self):
+        if self.writer is not None:
+            self.writer.close()
+            print(f"Exported {self.writer.frames} frames to {self.writer.path}")
 
+        seconds = time.perf_counter() - self.start_time
+        print(
+            f"Generation: {self.agent.generation}; Score: {self.score}; "
+            f"Simulated Time: {ai.seconds_to_str(self.ticks / 60)}; "
+            f"Wall Time: {seconds:.2f} s; Speed: {self.ticks / 60 / seconds:.1f}x"
+        )
+        pygame.quit()
+        raise SystemExit
+
+    def reset(self):
+        self.pendulum = Pendulum()
+        if self.episode[0]:
+            self.pendulum.x, self.pendulum.angle = self.episode[0]
+        self.ticks = 0
+        self.score = 0
+        self.last_output = 0
+
+    def draw(self):
+        # Draw rail, weight lines, labels and info texts
+        if self.background_agent is not self.agent:
+            self.draw_background()
+        self.window.blit(self.background, (0, 0))
+        self.draw_state()
+
+    def draw_state(self):
+        """
+        Draw the parts that change every tick on top of the background.
+        """
         # Draw pendulum
         self.draw_pendulum()
 
         # Draw neurons
-        neuron_positions = self.get_neuron_positions()
         for i, layer in enumerate(self.agent.layers):
             for j in range(layer):
-                self.draw_neuron(i, j, neuron_positions)
+                self.draw_neuron(i, j, self.neuron_positions)
+
+        # Draw episode text
+        self.font.render_to(
+            self.window,
+            (10, HEIGHT - 80),
+            f"Episode: {ai.seconds_to_str(self.ticks / 60)}; Score: {self.score:.0f}",
+            WHITE,
+            size=14,
+        )
+
+    def draw_background(self):
+        """
+        Draw the parts that only change with the agent to self.background,
+        which is copied to the window every frame.
+        """
+        self.background_agent = self.agent
+        self.neuron_positions = self.get_neuron_positions()
+        self.background.fill(BLACK)
 
-        # Draw info texts
-        self.draw_info()
+        self.draw_rail(self.background)
+        for i, layer in enumerate(self.agent.layers):
+            for j in range(layer):
+                self.draw_weights(self.background, i, j, self.neuron_positions)
+                self.draw_label(self.background, i, j, self.neuron_positions)
+        self.draw_info(self.background)
 
-    def draw_rail(self):
+    def draw_rail(self, surface):
         rail_start = self.center + Vec(self.unit_length, 0)
         rail_end = self.center - Vec(self.unit_length, 0)
-        pygame.draw.line(self.window, GRAY, rail_start.tolist(), rail_end.tolist(), 2)
+        pygame.draw.line(surface, GRAY, rail_start.tolist(), rail_end.tolist(), 2)
         rail_sections = 4
 
         for i in range(rail_sections + 1):
             x = rail_start.x * i / rail_sections + rail_end.x * (1 - i / rail_sections)
             rail_top = (x, rail_start.y + 3)
             rail_bottom = (x, rail_start.y + -3)
-            pygame.draw.line(self.window, WHITE, rail_top, rail_bottom, 1)
+            pygame.draw.line(surface, WHITE, rail_top, rail_bottom, 1)
 
     def draw_pendulum(self):
         cart = self.center + Vec(self.pendulum.x * self.unit_length, 0)
@@ -124,11 +324,9 @@ class Window:
 
         return positions
 
-    def draw_neuron(self, i, j, positions):
-        node_size = 10
+    def draw_weights(self, surface, i, j, positions):
         pos = positions[i][j]
 
-        # Draw weight lines
         if i + 1 < len(self.agent.layers):
             for k, pos2 in enumerate(positions[i + 1]):
                 weight = abs(self.agent.weights[i][j][k])
@@ -139,12 +337,36 @@ class Window:
                 )
                 for y in range(round(weight * 3)):
                     pygame.draw.aaline(
-                        self.window,
+                        surface,
                         color,
                         (pos[0], pos[1] + y * 0.8 - weight),
                         (pos2[0], pos2[1] + y * 0.8 - weight),
                     )
 
+    def draw_label(self, surface, i, j, positions):
+        pos = positions[i][j]
+
+        if i == 0:
+            self.font.render_to(
+                surface,
+                (10, pos[1] - 5),
+                ("cart.x", "cart.vel", "bob.x", "bob.y", "bob.vel")[j],
+                WHITE,
+                size=14,
+            )
+        elif i + 1 == len(self.agent.layers):
+            self.font.render_to(
+                surface,
+                (WIDTH - 90, pos[1] - 5),
+                "acceleration",
+                WHITE,
+                size=14,
+            )
+
+    def draw_neuron(self, i, j, positions):
+        node_size = 10
+        pos = positions[i][j]
+
         # Draw neuron background
         pygame.draw.circle(self.window, BLACK, pos, node_size)
 
@@ -163,34 +385,17 @@ class Window:
         # Draw neuron border
         pygame.draw.circle(self.window, WHITE, pos, node_size, 1)
 
-        # Draw neuron labels
-        if i == 0:
-            self.font.render_to(
-                self.window,
-                (10, pos[1] - 5),
-                ("cart.x", "cart.vel", "bob.x", "bob.y", "bob.vel")[j],
-                WHITE,
-                size=14,
-            )
-        elif i + 1 == len(self.agent.layers):
-            self.font.render_to(
-                self.window,
-                (WIDTH - 90, pos[1] - 5),
-                "acceleration",
-                WHITE,
-                size=14,
-            )
-
-    def draw_info(self):
+    def draw_info(self, surface):
+        # Drawn before the agent runs, while its ticks are the training ticks
         texts = (
-            "Real training time: " + self.real_time,
-            "Simulated training time: " + self.virtual_time,
+            "Real training time: " + ai.seconds_to_str(self.agent.time),
+            "Simulated training time: " + ai.seconds_to_str(self.agent.ticks / 60),
             "Generation: " + str(self.agent.generation),
         )
 
         for i, text in enumerate(texts):
             self.font.render_to(
-                self.window,
+                surface,
                 (10, HEIGHT - 110 - 30 * i),
                 text,
                 WHITE,
@@ -198,19 +403,22 @@ class Window:
             )
 
     def forward_ai(self):
+        """
+        Returns the output of the agent, 0 while it is disabled.
+        """
         if not self.ai_enabled:
-            return
-
-        output = self.agent.run(
-            self.pendulum.x,
-            self.pendulum.horizontal_velocity,
-            math.cos(self.pendulum.angle),
-            math.sin(self.pendulum.angle),
-            self.pendulum.angular_velocity,
-        )
-
-        acceleration = Vec(output[0] * 30, 0)
-        self.pendulum.apply_acceleration(acceleration)
+            return 0
+
+        inputs = self.ai_inputs
+        inputs[0] = self.pendulum.x
+        inputs[1] = self.pendulum.horizontal_velocity
+        inputs[2] = math.cos(self.pendulum.angle)
+        inputs[3] = math.sin(self.pendulum.angle)
+        inputs[4] = self.pendulum.angular_velocity
+        output = self.agent.forward(inputs)
+
+        self.pendulum.accelerate(output[0] * 30)
+        return output[0]
 
 
 if __name__ == "__main__":
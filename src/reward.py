@@ -0,0 +1,89 @@
+import numpy
+import math
+
+
+EDGE_PENALTY: float = 10  # Per tick and unit of distance from x=0
+CENTER_BONUS: float = 30  # Per tick while the cart is in the center
+CENTER_RANGE: float = 0.01
+OUTPUT_PENALTY: float = 5  # Per tick and unit of output
+JERK_PENALTY: float = 5  # Per tick and unit of output change
+AWAY_PENALTY: float = 3  # Per tick while accelerating away from the center
+AWAY_TICKS: int = 300  # Accelerating away is allowed during the first ticks
+
+# Bounds of the reward of a single tick for outputs in [-1, 1]
+MAX_TICK_SCORE: float = 1 + CENTER_BONUS
+MIN_TICK_SCORE: float = -(EDGE_PENALTY + OUTPUT_PENALTY + 2 * JERK_PENALTY + AWAY_PENALTY)
+
+
+def score_tick(score, x, angle, output, last_output, ticks, weight=1):
+    """
+    Returns the score after adding the reward of a single tick.
+    ticks is the number of ticks the agent has run, including this one.
+    weight is the number of ticks the reward stands for, when the agent
+    decides less often than every tick.
+    """
+    # Gain score while bob of the pendulum is above the x-axis close to x=0
+    y = -math.sin(angle)
+    if y > 0:
+        score += y * (1 - abs(x)) * weight
+
+    # Loose score close to edges
+    score -= abs(x) * EDGE_PENALTY * weight
+
+    if -CENTER_RANGE <= x <= CENTER_RANGE:
+        score += CENTER_BONUS * weight
+
+    score -= abs(output) * OUTPUT_PENALTY * weight
+
+    # Loose score for fast acceleration changes
+    score -= abs(output - last_output) * JERK_PENALTY * weight
+
+    # Loose score for accelerating away from center after 5 seconds
+    if ticks > AWAY_TICKS:
+        if x > 0 and output > 0:
+            score -= AWAY_PENALTY * weight
+        if x < 0 and output < 0:
+            score -= AWAY_PENALTY * weight
+
+    return score
+
+
+def score_tick_batch(score, x, angle, output, last_output, ticks, weight=1):
+    """
+    Adds the reward of a single tick to the score array in place.
+    All arguments except ticks and weight are arrays with one entry per agent.
+    The terms are added in the same order as in score_tick.
+    """
+    y = -numpy.sin(angle)
+    score += numpy.where(y > 0, y * (1 - numpy.abs(x)) * weight, 0)
+
+    score -= numpy.abs(x) * EDGE_PENALTY * weight
+
+    center = (-CENTER_RANGE <= x) & (x <= CENTER_RANGE)
+    score += numpy.where(center, CENTER_BONUS * weight, 0)
+
+    score -= numpy.abs(output) * OUTPUT_PENALTY * weight
+
+    score -= numpy.abs(output - last_output) * JERK_PENALTY * weight
+
+    if ticks > AWAY_TICKS:
+        away = (x > 0) & (output > 0) | (x < 0) & (output < 0)
+        score -= numpy.where(away, AWAY_PENALTY * weight, 0)
+
+    return score
+
+
+def score_trajectory(x, angle, output):
+    """
+    Returns the final scores of recorded trajectories.
+    The arguments have the shape (ticks, agents), where the first row
+    belongs to the first tick of the episode.
+    """
+    score = numpy.zeros(x.shape[1:])
+    last_output = numpy.zeros(x.shape[1:])
+
+    for tick in range(len(x)):
+        score_tick_batch(score, x[tick], angle[tick], output[tick], last_output, tick + 1)
+        last_output = output[tick]
+
+    return score
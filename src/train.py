@@ -1,6 +1,8 @@
-from pendulum import Pendulum
-from util import Vec, argv
+from pendulum import Pendulum, PendulumBatch, DELTA_TIME
+from util import argv
 import random
+import reward
+import numpy
 import math
 import ai
 
@@ -8,80 +10,421 @@ import ai
 AGENT_TIME = argv("time", 60.0) * 60
 RANDOM_START = argv("random-start", False)
 DISTRACTIONS = argv("distract", False)
+SHARED_MEMORY = argv("shared-memory", False)
+CHUNK_SIZE = argv("chunk-size", 1)
+CACHE_SIZE = argv("cache-size", 256)
+STOP_ON_FAILURE = argv("stop-on-failure", False)
+FAILURE = argv("failure", "pinned")  # Name of the failure predicate
+PRUNE = argv("prune", False)
+RUNGS = argv("rungs", "")
+OPTIMIZER = argv("optimizer", "hill")
+EPISODES = argv("episodes", 1)  # Episodes per agent and generation
+AGGREGATE = argv("aggregate", "mean")  # "mean", "min" or a quantile like "0.25"
+PHYSICS_VARIATION = argv("physics-variation", 0.0)  # Relative, of gravity and damping
+TIMING_FILE = argv("timing", "")  # JSONL file for the phase timings
+PROFILE_GENERATION = argv("profile-generation", -1)
+TELEMETRY_FILE = argv("telemetry", "")  # JSONL file for monitor.py
+CHECKPOINT_POLICY = argv("checkpoint-policy", ai.CHECKPOINT_POLICY)
+CHECKPOINT_INTERVAL = argv("checkpoint-interval", ai.CHECKPOINT_INTERVAL)
+POPULATION_INTERVAL = argv("population-interval", ai.POPULATION_INTERVAL)
+CONTROL_RATE = argv("control-rate", 60)  # Agent decisions per second, a divisor of 60
+INTEGRATOR = argv("integrator", "semi-implicit")  # One of pendulum.INTEGRATORS
+SUBSTEPS = argv("substeps", 1)  # Integrator steps per agent decision
 
+INPUTS = ["cart.x", "cart.vel", "bob.x", "bob.y", "bob.vel"]
+OUTPUTS = ["acceleration"]
+HIDDEN = [10, 10]
 
-def train(agent: ai.Agent):
-    pendulum = Pendulum()
-    random.seed(agent.generation)
+FAILURE_TICKS = 60  # Consecutive failing ticks before an agent is stopped
+PRUNE_INTERVAL = 60  # Ticks between comparisons with the best scores
 
-    last_acceleration = 0
 
-    if RANDOM_START and agent.generation % 2 == 1:
-        pendulum.x = random.uniform(-0.1, 0.1)
-        pendulum.angle = -math.pi / 2 + random.uniform(-0.3, 0.3)
-        # pendulum.angular_velocity = random.uniform(-3, 3)
-        # pendulum.horizontal_velocity = random.uniform(-3, 3)
+def control_ticks(rate: int):
+    """
+    Returns the ticks of 1/60 s per agent decision at a control rate.
+    """
+    if rate <= 0 or 60 % rate:
+        raise ValueError(f"The control rate must divide 60, got {rate}")
+    return 60 // rate
+
+
+CONTROL_TICKS = control_ticks(CONTROL_RATE)  # Ticks of 1/60 s per agent decision
+
+
+def physics(pendulum):
+    """
+    Applies the integrator settings to a Pendulum or PendulumBatch.
+    """
+    pendulum.integrator = INTEGRATOR
+    pendulum.substeps = SUBSTEPS
+    return pendulum
+
+
+def pinned(pendulum):
+    """
+    Default failure predicate, true while the cart stands at a rail.
+    Works for Pendulum and PendulumBatch.
+    """
+    return numpy.abs(pendulum.x) >= 1
+
+
+FAILURE_PREDICATES: dict = {"pinned": pinned}  # By name, for --failure
+FAILURE_PREDICATE = FAILURE_PREDICATES[FAILURE]
+
+
+def rungs(string: str):
+    """
+    Returns the rungs of successive halving from a string like "10:0.5,30"
+    of horizons in seconds, each with the fraction of agents that is kept
+    for the next rung (default: 0.5).
+    """
+    result = []
+    for rung in filter(None, string.split(",")):
+        seconds, _, keep = rung.partition(":")
+        result.append((round(float(seconds) * 60), float(keep or 0.5)))
+    return result
+
+
+def episode(generation: int):
+    """
+    Returns the start state and the distraction of the episode of a generation.
+    The start state is None for the default start state of the pendulum.
+    """
+    rng = random.Random(generation)
+    start = None
+
+    if RANDOM_START and generation % 2 == 1:
+        start = (rng.uniform(-0.1, 0.1), -math.pi / 2 + rng.uniform(-0.3, 0.3))
+        # pendulum.angular_velocity = rng.uniform(-3, 3)
+        # pendulum.horizontal_velocity = rng.uniform(-3, 3)
 
     if DISTRACTIONS:
-        distraction_time = random.randint(0, AGENT_TIME)
-        distraction_strength = random.uniform(-50, 50)
+        distraction_time = rng.randint(0, int(AGENT_TIME))
+        distraction_strength = rng.uniform(-50, 50)
     else:
         distraction_time = -1
+        distraction_strength = 0
 
-    score = 0
+    return start, distraction_time, distraction_strength
 
-    while agent.ticks < AGENT_TIME:
-        output = agent.run(
-            pendulum.x,
-            pendulum.horizontal_velocity,
-            math.cos(pendulum.angle),
-            math.sin(pendulum.angle),
-            pendulum.angular_velocity,
+
+def scenarios(generation: int):
+    """
+    Returns arrays with the start state, distraction and physics of each of
+    the EPISODES episodes of a generation. Episode k has the start state
+    and distraction of episode(generation * EPISODES + k), and gravity and
+    damping varied by up to PHYSICS_VARIATION around those of Pendulum.
+    """
+    pendulum = Pendulum()
+    keys = ("x", "angle", "distraction_time", "distraction_strength")
+    result = {key: numpy.zeros(EPISODES) for key in keys}
+
+    for k in range(EPISODES):
+        start, distraction_time, distraction_strength = episode(
+            generation * EPISODES + k
         )
+        result["x"][k], result["angle"][k] = start or (pendulum.x, pendulum.angle)
+        result["distraction_time"][k] = distraction_time
+        result["distraction_strength"][k] = distraction_strength
+
+    rng = numpy.random.default_rng(generation)
+    variation = 1 + rng.uniform(-PHYSICS_VARIATION, PHYSICS_VARIATION, (3, EPISODES))
+    result["gravity"] = pendulum.gravity * variation[0]
+    result["angular_damping"] = pendulum.angular_damping * variation[1]
+    result["horizontal_damping"] = pendulum.horizontal_damping * variation[2]
+
+    return result
+
 
-        acceleration = Vec(output[0] * 30, 0)
-        pendulum.apply_acceleration(acceleration)
-        pendulum.update()
+def aggregate(scores: numpy.ndarray):
+    """
+    Returns the fitness of each agent from scores of the shape (agents, episodes).
+    """
+    if AGGREGATE == "mean":
+        return scores.mean(1)
+    if AGGREGATE == "min":
+        return scores.min(1)
+    return numpy.quantile(scores, float(AGGREGATE), axis=1)
 
-        if distraction_time == agent.ticks:
-            pendulum.apply_acceleration(Vec(distraction_strength, 0))
 
-        # Gain score while bob of the pendulum is above the x-axis close to x=0
-        y = -math.sin(pendulum.angle)
-        if y > 0:
-            score += y * (1 - abs(pendulum.x))
+def episode_key(generation: int):
+    """
+    Returns everything besides the agent that decides the score of an
+    episode. Generations with equal keys give agents equal scores.
+    """
+    pendulum = Pendulum()
+    physics = (pendulum.gravity, pendulum.angular_damping, pendulum.horizontal_damping)
+    physics += (CONTROL_TICKS, INTEGRATOR, SUBSTEPS)
+    stopping = (STOP_ON_FAILURE and FAILURE_TICKS, FAILURE_PREDICATE.__name__)
+    episodes = [episode(generation * EPISODES + k) for k in range(EPISODES)]
+    variation = (AGGREGATE, PHYSICS_VARIATION, PHYSICS_VARIATION and generation)
+    return (AGENT_TIME, *physics, *stopping, *variation, *episodes)
+
+
+def horizon(agent):
+    """
+    Returns the number of ticks an agent or batch of agents is simulated.
+    """
+    if agent.horizon is None:
+        return AGENT_TIME
+    return min(agent.horizon, AGENT_TIME)
+
 
-        # Loose score close to edges
-        score -= abs(pendulum.x) * 10
+def extrapolate(score, start_ticks, start_score, ticks, end):
+    """
+    Returns the score of a failed agent at tick end, assuming it keeps the
+    average reward it received since it started failing at start_ticks.
+    Works for scalars and arrays.
+    """
+    rate = (score - start_score) / (ticks - start_ticks)
+    return score + rate * (end - ticks)
 
-        if -0.01 <= pendulum.x <= 0.01:
-            score += 30
 
-        score -= abs(output[0]) * 5
+def train(agent: ai.Agent):
+    """
+    Returns the score of an agent after its episode, which is cut short
+    to the horizon of the agent during successive halving.
+    With STOP_ON_FAILURE, a failed agent stops early with an extrapolated
+    score and is marked as estimated. With PRUNE, an agent that cannot reach
+    the best scores of the generation anymore stops early and returns its
+    upper bound instead.
+    Several episodes or varied physics are simulated as a batch.
+    """
+    if EPISODES > 1 or PHYSICS_VARIATION:
+        return train_scenarios(agent)
+
+    pendulum = physics(Pendulum())
+    start, distraction_time, distraction_strength = episode(agent.generation)
+
+    last_acceleration = 0
 
-        # Loose score for fast acceleration changes
-        score -= abs(output[0] - last_acceleration) * 5
+    if start:
+        pendulum.x, pendulum.angle = start
+
+    score = 0
+    inputs = numpy.zeros(5)
+    failure_start = None  # Ticks and score at the first failing tick
+    end = horizon(agent)
+
+    while agent.ticks < end:
+        # The last decision is cut short to the end of the episode
+        steps = min(CONTROL_TICKS, math.ceil(end - agent.ticks))
+        inputs[0] = pendulum.x
+        inputs[1] = pendulum.horizontal_velocity
+        inputs[2] = math.cos(pendulum.angle)
+        inputs[3] = math.sin(pendulum.angle)
+        inputs[4] = pendulum.angular_velocity
+        output = agent.forward(inputs)
+        agent.ticks += steps - 1
+
+        pendulum.step(output[0] * 30, steps * DELTA_TIME)
+
+        if 0 <= agent.ticks - distraction_time < steps:
+            pendulum.accelerate(distraction_strength)
+
+        score = reward.score_tick(
+            score,
+            pendulum.x,
+            pendulum.angle,
+            output[0],
+            last_acceleration,
+            agent.ticks,
+            steps,
+        )
         last_acceleration = output[0]
 
-        # Loose score for accelerating away from center after 5 seconds
-        if agent.ticks > 300:
-            if pendulum.x > 0 and output[0] > 0:
-                score -= 3
-            if pendulum.x < 0 and output[0] < 0:
-                score -= 3
+        if STOP_ON_FAILURE:
+            if not FAILURE_PREDICATE(pendulum):
+                failure_start = None
+            elif failure_start is None:
+                failure_start = (agent.ticks, score)
+            elif agent.ticks - failure_start[0] >= FAILURE_TICKS:
+                agent.estimated = True
+                return extrapolate(score, *failure_start, agent.ticks, end)
+
+        if PRUNE and agent.ticks % PRUNE_INTERVAL == 0:
+            bound = score + (end - agent.ticks) * reward.MAX_TICK_SCORE
+            if bound < ai.score_threshold():
+                return bound
 
     return score
 
 
+def train_scenarios(agent: ai.Agent):
+    """
+    Returns the score of a single agent from train_batch.
+    """
+    weights = numpy.concatenate([weights.ravel() for weights in agent.weights])
+    biases = numpy.concatenate(agent.biases)
+    agents = ai.AgentBatch(
+        agent.layers,
+        weights[numpy.newaxis, :],
+        biases[numpy.newaxis, :],
+        agent.hidden_activation,
+        agent.output_activation,
+        agent.generation,
+        agent.horizon,
+    )
+
+    scores, ticks = train_batch(agents)
+    agent.ticks += int(ticks[0])
+    agent.estimated = bool(agents.estimated[0])
+    return scores[0]
+
+
+def train_batch(agents: ai.AgentBatch):
+    """
+    Same as train, but for all agents of the batch at once, each on the
+    EPISODES episodes of the generation.
+    Returns arrays with the aggregated score and the total ticks of each agent.
+    Episodes that stop early are removed from the batch. Agents with an
+    extrapolated episode are marked in agents.estimated.
+    """
+    num_agents = agents.num_agents
+    end = horizon(agents)
+    episodes = {
+        key: numpy.tile(values, num_agents)
+        for key, values in scenarios(agents.generation).items()
+    }
+
+    # One row per episode, the episodes of each agent are adjacent
+    agents.repeat(EPISODES)
+    rows = agents.num_agents
+    pendulums = physics(PendulumBatch(rows))
+    pendulums.x[:] = episodes["x"]
+    pendulums.angle[:] = episodes["angle"]
+    pendulums.gravity[:] = episodes["gravity"]
+    pendulums.angular_damping[:] = episodes["angular_damping"]
+    pendulums.horizontal_damping[:] = episodes["horizontal_damping"]
+    distraction_time = episodes["distraction_time"]
+    distraction_strength = episodes["distraction_strength"]
+
+    last_acceleration = numpy.zeros(rows)
+    score = numpy.zeros(rows)
+    inputs = numpy.zeros((rows, 5))
+
+    # Results of stopped episodes and original rows of the running ones
+    final_scores = numpy.full(rows, -math.inf)
+    final_ticks = numpy.full(rows, math.ceil(end))
+    indices = numpy.arange(rows)
+    failure_ticks = numpy.full(rows, -1)
+    failure_scores = numpy.zeros(rows)
+    estimated = numpy.zeros(rows, dtype=bool)
+
+    while agents.ticks < end and agents.num_agents:
+        steps = min(CONTROL_TICKS, math.ceil(end - agents.ticks))
+        inputs[:, 0] = pendulums.x
+        inputs[:, 1] = pendulums.horizontal_velocity
+        numpy.cos(pendulums.angle, out=inputs[:, 2])
+        numpy.sin(pendulums.angle, out=inputs[:, 3])
+        inputs[:, 4] = pendulums.angular_velocity
+        output = agents.run(inputs)[:, 0]
+        agents.ticks += steps - 1
+
+        pendulums.step(output * 30, steps * DELTA_TIME)
+
+        since_distraction = agents.ticks - distraction_time
+        distracted = (0 <= since_distraction) & (since_distraction < steps)
+        if distracted.any():
+            pendulums.apply_acceleration(distraction_strength, where=distracted)
+
+        reward.score_tick_batch(
+            score,
+            pendulums.x,
+            pendulums.angle,
+            output,
+            last_acceleration,
+            agents.ticks,
+            steps,
+        )
+        last_acceleration = output
+
+        stop = numpy.zeros(agents.num_agents, dtype=bool)
+        remaining = end - agents.ticks
+
+        if STOP_ON_FAILURE:
+            failing = FAILURE_PREDICATE(pendulums)
+            started = failing & (failure_ticks < 0)
+            failure_ticks[~failing] = -1
+            failure_ticks[started] = agents.ticks
+            failure_scores[started] = score[started]
+
+            stop = failing & (agents.ticks - failure_ticks >= FAILURE_TICKS)
+            stop &= ~started
+            final_scores[indices[stop]] = extrapolate(
+                score[stop],
+                failure_ticks[stop],
+                failure_scores[stop],
+                agents.ticks,
+                end,
+            )
+            estimated[indices[stop]] = True
+
+        if PRUNE and agents.ticks % PRUNE_INTERVAL == 0:
+            # Bounds of the aggregated scores, as every aggregation is monotonic
+            running = ~stop
+            upper = final_scores.copy()
+            upper[indices[running]] = score[running] + remaining * reward.MAX_TICK_SCORE
+            lower = final_scores.copy()
+            lower[indices[running]] = score[running] + remaining * reward.MIN_TICK_SCORE
+            lower[estimated] = -math.inf  # Extrapolations are no bounds
+            agent_upper = aggregate(upper.reshape(num_agents, EPISODES))
+            agent_lower = aggregate(lower.reshape(num_agents, EPISODES))
+
+            # The lowest of the best lower bounds is reached by enough agents
+            exact = ai.exact_agents()
+            threshold = ai.score_threshold()
+            if num_agents >= exact:
+                lower_bound = numpy.partition(agent_lower, -exact)[-exact]
+                threshold = max(threshold, lower_bound)
+
+            pruned = running & (agent_upper[indices // EPISODES] < threshold)
+            final_scores[indices[pruned]] = upper[indices[pruned]]
+            stop |= pruned
+
+        if stop.any():
+            final_ticks[indices[stop]] = agents.ticks
+            keep = ~stop
+            agents.keep(keep)
+            pendulums.keep(keep)
+            indices = indices[keep]
+            score = score[keep]
+            inputs = inputs[keep]
+            last_acceleration = last_acceleration[keep]
+            failure_ticks = failure_ticks[keep]
+            failure_scores = failure_scores[keep]
+            distraction_time = distraction_time[keep]
+            distraction_strength = distraction_strength[keep]
+
+    final_scores[indices] = score
+    agents.estimated = estimated.reshape(num_agents, EPISODES).any(1)
+    scores = aggregate(final_scores.reshape(num_agents, EPISODES))
+    return scores, final_ticks.reshape(num_agents, EPISODES).sum(1)
+
+
 def main():
     rlm = ai.ReinforcementLearningModel(
         func=train,
+        batch_func=train_batch,
         num_agents=50,
-        inputs=["cart.x", "cart.vel", "bob.x", "bob.y", "bob.vel"],
-        outputs=["acceleration"],
-        hidden=[10, 10],
+        inputs=INPUTS,
+        outputs=OUTPUTS,
+        hidden=HIDDEN,
         hidden_activation="tanh",
         output_activation="tanh",
+        shared_memory=SHARED_MEMORY,
+        chunk_size=CHUNK_SIZE,
+        cache_size=CACHE_SIZE,
+        episode_key=episode_key,
+        prune=PRUNE,
+        rungs=rungs(RUNGS),
+        optimizer=OPTIMIZER,
+        timing_file=TIMING_FILE,
+        profile_generation=PROFILE_GENERATION,
+        telemetry_file=TELEMETRY_FILE,
+        checkpoint_policy=CHECKPOINT_POLICY,
+        checkpoint_interval=CHECKPOINT_INTERVAL,
+        population_interval=POPULATION_INTERVAL,
     )
     rlm.train()
 
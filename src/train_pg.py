@@ -0,0 +1,281 @@
+from pendulum import PendulumBatch
+from util import argv
+import reward
+import train
+import numpy
+import time
+import math
+import ai
+
+
+NUM_ENVS = argv("envs", 64)  # Pendulums simulated in parallel per iteration
+ITERATIONS = argv("iterations", 1000)
+LEARNING_RATE = argv("learning-rate", 0.01)
+DISCOUNT: float = 0.99
+VALUE_HIDDEN: list[int] = [32]  # Hidden layers of the value baseline
+LOG_STD_RANGE: tuple = (-3.0, 0.0)  # Bounds of the log standard deviation of actions
+
+
+class Network:
+    """
+    Fully connected network with tanh hidden layers, trained with
+    backpropagation. weights and biases are lists with one array per layer
+    in the layout of ai.Agent, so the policy can be saved as a generation.
+    """
+
+    def __init__(self, layers, output_activation="tanh", rng=None, agent=None):
+        self.layers = list(layers)
+        self.output_activation = output_activation
+        self._activations = []
+
+        if agent is not None:
+            self.weights = [weights.copy() for weights in agent.weights]
+            self.biases = [biases.copy() for biases in agent.biases]
+            return
+
+        self.weights = [
+            rng.normal(0, 1 / math.sqrt(n), (n, m))
+            for n, m in zip(self.layers, self.layers[1:])
+        ]
+        self.biases = [numpy.zeros(m) for m in self.layers[1:]]
+
+    def parameters(self):
+        return [*self.weights, *self.biases]
+
+    def forward(self, inputs: numpy.ndarray):
+        """
+        Returns the outputs for inputs of the shape (n, inputs) and keeps the
+        activations for backward.
+        """
+        self._activations = [inputs]
+        for i, (weights, biases) in enumerate(zip(self.weights, self.biases)):
+            values = inputs @ weights + biases
+            if i + 1 < len(self.weights) or self.output_activation == "tanh":
+                values = numpy.tanh(values)
+            self._activations.append(values)
+            inputs = values
+        return inputs
+
+    def backward(self, output_gradient: numpy.ndarray):
+        """
+        Returns the gradients of all parameters, in the order of parameters(),
+        from the gradient of the loss with respect to the last outputs.
+        """
+        weight_gradients = []
+        bias_gradients = []
+        gradient = output_gradient
+
+        for i in reversed(range(len(self.weights))):
+            if i + 1 < len(self.weights) or self.output_activation == "tanh":
+                gradient = gradient * (1 - self._activations[i + 1] ** 2)
+            weight_gradients.append(self._activations[i].T @ gradient)
+            bias_gradients.append(gradient.sum(0))
+            gradient = gradient @ self.weights[i].T
+
+        return [*reversed(weight_gradients), *reversed(bias_gradients)]
+
+    def flat(self):
+        """
+        Returns the flat weights and biases as stored in generation data.
+        """
+        weights = numpy.concatenate([weights.ravel() for weights in self.weights])
+        biases = numpy.concatenate(self.biases)
+        return weights, biases
+
+
+class Adam:
+    """
+    Adam optimizer that updates a list of arrays in place.
+    """
+
+    def __init__(self, parameters: list, learning_rate: float):
+        self.parameters = parameters
+        self.learning_rate = learning_rate
+        self.beta1 = 0.9
+        self.beta2 = 0.999
+        self.steps = 0
+        self.m = [numpy.zeros_like(parameter) for parameter in parameters]
+        self.v = [numpy.zeros_like(parameter) for parameter in parameters]
+
+    def step(self, gradients: list):
+        self.steps += 1
+        correction1 = 1 - self.beta1**self.steps
+        correction2 = 1 - self.beta2**self.steps
+
+        moments = zip(self.parameters, gradients, self.m, self.v)
+        for parameter, gradient, m, v in moments:
+            m *= self.beta1
+            m += (1 - self.beta1) * gradient
+            v *= self.beta2
+            v += (1 - self.beta2) * gradient**2
+            step = (m / correction1) / (numpy.sqrt(v / correction2) + 1e-8)
+            parameter -= self.learning_rate * step
+
+
+def rollout(policy: Network, log_std, rng, iteration: int):
+    """
+    Simulate NUM_ENVS pendulums for one episode of train.py with actions
+    sampled around the policy outputs.
+    Returns the observations, actions and rewards of every tick, each with
+    the shape (ticks, envs, ...), and the final score of each pendulum.
+    """
+    ticks = math.ceil(train.AGENT_TIME)
+    pendulums = PendulumBatch(NUM_ENVS)
+    start, distraction_time, distraction_strength = train.episode(iteration)
+
+    if start:
+        pendulums.x[:], pendulums.angle[:] = start
+
+    observations = numpy.zeros((ticks, NUM_ENVS, len(train.INPUTS)))
+    actions = numpy.zeros((ticks, NUM_ENVS))
+    rewards = numpy.zeros((ticks, NUM_ENVS))
+    score = numpy.zeros(NUM_ENVS)
+    last_output = numpy.zeros(NUM_ENVS)
+
+    for tick in range(ticks):
+        inputs = observations[tick]
+        inputs[:, 0] = pendulums.x
+        inputs[:, 1] = pendulums.horizontal_velocity
+        numpy.cos(pendulums.angle, out=inputs[:, 2])
+        numpy.sin(pendulums.angle, out=inputs[:, 3])
+        inputs[:, 4] = pendulums.angular_velocity
+
+        mean = policy.forward(inputs)[:, 0]
+        actions[tick] = mean + math.exp(log_std) * rng.standard_normal(NUM_ENVS)
+        output = numpy.clip(actions[tick], -1, 1)
+
+        pendulums.apply_acceleration(output * 30)
+        pendulums.update()
+
+        if distraction_time == tick + 1:
+            pendulums.apply_acceleration(distraction_strength)
+
+        rewards[tick] = score
+        reward.score_tick_batch(
+            score, pendulums.x, pendulums.angle, output, last_output, tick + 1
+        )
+        rewards[tick] = score - rewards[tick]
+        last_output = output
+
+    return observations, actions, rewards, score
+
+
+def discounted_returns(rewards: numpy.ndarray):
+    """
+    Returns the discounted sum of the following rewards for every tick.
+    """
+    returns = numpy.zeros_like(rewards)
+    following = numpy.zeros(rewards.shape[1:])
+    for tick in reversed(range(len(rewards))):
+        following = rewards[tick] + DISCOUNT * following
+        returns[tick] = following
+    return returns
+
+
+def update(policy, value, log_std, optimizers, observations, actions, rewards):
+    """
+    One REINFORCE step with the value network as baseline.
+    log_std, the log standard deviation of the actions, is updated in place.
+    """
+    observations = observations.reshape(-1, observations.shape[-1])
+    actions = actions.ravel()
+    returns = discounted_returns(rewards).ravel()
+    returns = (returns - returns.mean()) / (returns.std() + 1e-8)
+    count = len(returns)
+
+    # Baseline
+    baseline = value.forward(observations)[:, 0]
+    value_gradient = (baseline - returns)[:, numpy.newaxis] / count
+    optimizers[0].step(value.backward(value_gradient))
+
+    advantages = returns - baseline
+    advantages = (advantages - advantages.mean()) / (advantages.std() + 1e-8)
+
+    # Gradient of -mean(advantage * log probability of the action)
+    mean = policy.forward(observations)[:, 0]
+    std = math.exp(log_std[0])
+    deviation = (actions - mean) / std
+    mean_gradient = -advantages * deviation / std / count
+    log_std_gradient = -numpy.mean(advantages * (deviation**2 - 1))
+
+    policy_gradients = policy.backward(mean_gradient[:, numpy.newaxis])
+    optimizers[1].step([*policy_gradients, log_std_gradient])
+    numpy.clip(log_std, *LOG_STD_RANGE, out=log_std)
+
+
+def main():
+    rng = numpy.random.default_rng()
+    layers = numpy.array([len(train.INPUTS), *train.HIDDEN, len(train.OUTPUTS)])
+
+    # Continue from the newest generation if it has the same network
+    data = None
+    policy = Network(layers, rng=rng)
+    if ai.newest_generation() != -1:
+        agent = ai.Agent.load()
+        if list(agent.layers) == list(layers):
+            policy = Network(layers, agent=agent)
+            data = {
+                "generation": agent.generation,
+                "ticks": agent.ticks,
+                "time": agent.time,
+            }
+    data = data or {"generation": -1, "ticks": 0, "time": 0}
+
+    value = Network([len(train.INPUTS), *VALUE_HIDDEN, 1], None, rng)
+    log_std = numpy.array([math.log(0.3)])
+    optimizers = (
+        Adam(value.parameters(), LEARNING_RATE),
+        Adam([*policy.parameters(), log_std], LEARNING_RATE),
+    )
+
+    checkpoints = ai.CheckpointWriter(
+        ai.CHECKPOINT_POLICY, ai.CHECKPOINT_INTERVAL, ai.CHECKPOINT_QUEUE_SIZE
+    )
+    last_checkpoint = None
+    last_time = time.time()
+
+    try:
+        for _ in range(ITERATIONS):
+            data["generation"] += 1
+            observations, actions, rewards, scores = rollout(
+                policy, log_std[0], rng, data["generation"]
+            )
+            update(policy, value, log_std, optimizers, observations, actions, rewards)
+
+            t = time.time()
+            data["ticks"] += rewards.size
+            data["time"] += t - last_time
+            last_time = t
+
+            # Checkpoints have the format of ai.ReinforcementLearningModel
+            weights, biases = policy.flat()
+            generation_data = {
+                **data,
+                "inputs": train.INPUTS,
+                "outputs": train.OUTPUTS,
+                "layers": layers,
+                "hidden_activation": "tanh",
+                "output_activation": "tanh",
+                "weights": weights,
+                "biases": biases,
+            }
+            last_checkpoint = (generation_data, scores.mean())
+            checkpoints.submit(generation_data, scores.mean())
+
+            if ai.PRINT_RESULTS:
+                print(
+                    f"Iteration: {data['generation']}; Mean Score: {scores.mean()}; "
+                    f"Action Std: {math.exp(log_std[0]):.3f}; "
+                    f"Total Time: {round(data['ticks'] / 60)}"
+                )
+    finally:
+        # Always keep the policy of the last iteration
+        if last_checkpoint is not None:
+            generation_data, score = last_checkpoint
+            if checkpoints.last_generation != generation_data["generation"]:
+                checkpoints.submit(generation_data, score, force=True)
+        checkpoints.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -26,8 +26,10 @@ def abspath(dir: str):
 
 
 class Vec:
+    __slots__ = ("x", "y")
+
     def __init__(self, x: "Vec" | Number = 0, y: Number = 0):
-        if isinstance(x, Number):
+        if isinstance(x, (float, int)):  # A tuple is faster than the Number union
             self.x = x
             self.y = y
         else:
@@ -76,6 +78,26 @@ class Vec:
     def __floordiv__(self, value: Number):
         return Vec(self.x // value, self.y // value)
 
+    def __iadd__(self, other: "Vec"):
+        self.x += other.x
+        self.y += other.y
+        return self
+
+    def __isub__(self, other: "Vec"):
+        self.x -= other.x
+        self.y -= other.y
+        return self
+
+    def __imul__(self, value: Number):
+        self.x *= value
+        self.y *= value
+        return self
+
+    def __itruediv__(self, value: Number):
+        self.x /= value
+        self.y /= value
+        return self
+
     def __neg__(self):
         return Vec(-self.x, -self.y)
 
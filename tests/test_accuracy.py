@@ -0,0 +1,21 @@
+import accuracy
+import ai
+
+
+def test_replay(monkeypatch):
+    monkeypatch.setattr(accuracy, "TIME", 2.0)
+    monkeypatch.setattr(accuracy, "REFERENCE_RATE", 1200)
+    states, actions = accuracy.reference(ai.Agent.load(17000), 20)
+    assert len(states) == len(actions) + 1 == 41
+
+    # The errors shrink with the steps, instead of growing with the chaos
+    errors = {
+        integrator: [
+            accuracy.replay(states, actions, 20, integrator, substeps)[1]
+            for substeps in (1, 2, 4)
+        ]
+        for integrator in ("semi-implicit", "rk4")
+    }
+    for integrator_errors in errors.values():
+        assert integrator_errors[0] > integrator_errors[1] > integrator_errors[2]
+    assert errors["rk4"][0] < errors["semi-implicit"][2]
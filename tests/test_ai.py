@@ -1,3 +1,13 @@
+import multiprocessing
+import pytest
+import threading
+import random
+import pstats
+import time
+import numpy
+import math
+import json
+import os
 import ai
 
 
@@ -38,3 +48,481 @@ def test_time_conversion():
     assert ai.seconds_to_str(3736) == "1 hour, 2 minutes"
     assert ai.seconds_to_str(86400) == "1 day"
     assert ai.seconds_to_str(270000) == "3 days, 3 hours"
+
+
+def test_agent_batch():
+    layers = numpy.array([5, 10, 10, 1])
+    num_weights = sum(layers[1:] * layers[:-1])
+    num_biases = sum(layers[1:])
+    rng = numpy.random.default_rng(0)
+    weights = rng.uniform(-1, 1, (7, num_weights))
+    biases = rng.uniform(-1, 1, (7, num_biases))
+    tanh = ai.ActivationFunction.tanh
+
+    batch = ai.AgentBatch(layers, weights, biases, tanh, tanh, 0)
+    agents = [ai.Agent(layers, w, b, tanh, tanh, 0) for w, b in zip(weights, biases)]
+
+    for _ in range(3):
+        inputs = rng.uniform(-1, 1, (7, 5))
+        outputs = batch.run(inputs)
+        assert outputs.shape == (7, 1)
+        for agent, agent_inputs, output in zip(agents, inputs, outputs):
+            assert numpy.allclose(agent.run(*agent_inputs), output, rtol=0, atol=1e-12)
+
+
+def test_agent_forward():
+    layers = numpy.array([5, 10, 10, 1])
+    rng = numpy.random.default_rng(1)
+    weights = rng.uniform(-1, 1, sum(layers[1:] * layers[:-1]))
+    biases = rng.uniform(-1, 1, sum(layers[1:]))
+    inputs = numpy.zeros(5)
+
+    for hidden, output in (("relu", "sigmoid"), ("tanh", "tanh")):
+        hidden = ai._activation_function(hidden)
+        output = ai._activation_function(output)
+        agent = ai.Agent(layers, weights, biases, hidden, output, 0)
+        fast_agent = ai.Agent(layers, weights, biases, hidden, output, 0)
+
+        for i in range(4):
+            inputs[:] = rng.uniform(-1, 1, 5)
+            expected = agent.run(*inputs)
+            if i == 2:  # Run replaces the arrays used by forward
+                fast_agent.run(*inputs)
+            # The biases are added within the dot product, in another order
+            output = fast_agent.forward(inputs)
+            assert numpy.allclose(output, expected, rtol=0, atol=1e-12)
+            for fast_values, values in zip(fast_agent.values, agent.values):
+                assert numpy.allclose(fast_values, values, rtol=0, atol=1e-12)
+
+        assert fast_agent.ticks == 5
+
+
+def _score(agent):
+    """
+    Simple fitness function for training tests.
+    """
+    inputs = numpy.linspace(-1, 1, agent.layers[0])
+    return float(agent.forward(inputs)[0]) + agent.generation
+
+
+def _train_model(directory, func=_score, **kwargs):
+    ai.GENERATION_DIRECTORY = str(directory)
+    numpy.random.seed(0)
+    random.seed(0)
+    model = ai.ReinforcementLearningModel(
+        func,
+        num_agents=6,
+        inputs=["a", "b"],
+        outputs=["c"],
+        hidden=[3],
+        hidden_activation="tanh",
+        output_activation="tanh",
+        **kwargs,
+    )
+    model.train()
+    return model
+
+
+def _record_scores(monkeypatch):
+    """
+    Returns a list that receives the scores of every evaluation of
+    ReinforcementLearningModel, one list per call.
+    """
+    scores = []
+    evaluate = ai.ReinforcementLearningModel._evaluate
+
+    def recorded(self, *args, **kwargs):
+        results = evaluate(self, *args, **kwargs)
+        scores.append([float(result[0]) for result in results])
+        return results
+
+    monkeypatch.setattr(ai.ReinforcementLearningModel, "_evaluate", recorded)
+    return scores
+
+
+@pytest.fixture
+def training(tmp_path, monkeypatch):
+    monkeypatch.setattr(ai, "GENERATION_DIRECTORY", str(tmp_path))
+    monkeypatch.setattr(ai, "SESSION_GENERATIONS", 3)
+    monkeypatch.setattr(ai, "NUM_WORKERS", 2)
+    monkeypatch.setattr(ai, "PRINT_RESULTS", False)
+    return tmp_path
+
+
+def test_shared_memory_training(training, monkeypatch):
+    scores = _record_scores(monkeypatch)
+    expected = _train_model(training / "default")
+    expected_scores = scores[:]
+    scores.clear()
+    model = _train_model(training / "shared", shared_memory=True)
+
+    # Workers read the weights from shared memory instead of pickled copies
+    assert len(scores) == 3
+    assert scores == expected_scores
+    assert model.data["generation"] == expected.data["generation"] == 2
+    assert numpy.array_equal(model.weights, expected.weights)
+    assert numpy.array_equal(model.biases, expected.biases)
+    assert not model._shared_memory_blocks
+
+
+def _score_batch(agents):
+    inputs = numpy.linspace(-1, 1, agents.layers[0])
+    inputs = inputs[numpy.newaxis, :].repeat(agents.num_agents, 0)
+    return agents.run(inputs)[:, 0] + agents.generation
+
+
+def test_chunked_training(training, monkeypatch):
+    scores = _record_scores(monkeypatch)
+    expected = _train_model(training / "default")
+    expected_scores = scores[:]
+
+    for chunk_size, shared_memory in ((4, False), (0, True)):
+        scores.clear()
+        model = _train_model(
+            training / f"chunk{chunk_size}",
+            chunk_size=chunk_size,
+            shared_memory=shared_memory,
+        )
+        assert scores == expected_scores  # Same scores as one task per agent
+        assert numpy.array_equal(model.weights, expected.weights)
+        assert numpy.array_equal(model.biases, expected.biases)
+
+    scores.clear()
+    model = _train_model(training / "batch", batch_func=_score_batch, chunk_size=0)
+    assert model.data["generation"] == 2
+    assert numpy.allclose(scores, expected_scores, rtol=0, atol=1e-12)
+
+
+def test_generation_manifest(tmp_path, monkeypatch):
+    monkeypatch.setattr(ai, "GENERATION_DIRECTORY", str(tmp_path))
+    monkeypatch.setattr(ai, "SAVE_FORMAT", "json")
+    data = {
+        "layers": numpy.array([1, 1]),
+        "weights": numpy.zeros(1),
+        "biases": numpy.zeros(1),
+    }
+    assert ai.newest_generation() == -1
+
+    for generation in (3, 4):
+        (tmp_path / f"gen{generation}.json").write_text("{}")
+    assert ai.newest_generation() == 4  # Built from the directory
+    assert ai._read_manifest() == 4
+
+    def listdir(path):
+        raise AssertionError("Directory scanned although the manifest is valid")
+
+    with monkeypatch.context() as context:
+        context.setattr(ai.os, "listdir", listdir)
+        assert ai.newest_generation() == 4
+        ai.save_generation_data(dict(data, generation=10))
+        assert ai.newest_generation() == 10
+
+        # Population snapshots do not make the manifest stale
+        state = {
+            "data": {"generation": 10},
+            "weights": numpy.zeros((2, 1)),
+            "biases": numpy.zeros((2, 1)),
+            "numpy_random": numpy.random.get_state(),
+            "random": random.getstate(),
+        }
+        ai.save_population(state)
+        assert ai.newest_generation() == 10
+
+    # Files added or removed by others make the manifest stale, also with gaps
+    (tmp_path / "gen20.json").write_text("{}")
+    assert ai.newest_generation() == 20
+    (tmp_path / "gen20.json").unlink()
+    (tmp_path / "gen10.json").unlink()
+    assert ai.newest_generation() == 4
+    (tmp_path / "latest.json").write_text("invalid")
+    assert ai.newest_generation() == 4
+    assert ai._read_manifest() == 4
+
+    # A read-only directory is scanned every time
+    def write_manifest(generation):
+        raise PermissionError("Read-only")
+
+    (tmp_path / "latest.json").unlink()
+    monkeypatch.setattr(ai, "_write_manifest", write_manifest)
+    assert ai.newest_generation() == 4
+    assert ai._read_manifest() is None
+
+
+def test_checkpoint_writer(monkeypatch):
+    saved = []
+    blocked = threading.Event()
+    monkeypatch.setattr(ai, "save_generation_data", lambda data: saved.append(data))
+
+    writer = ai.CheckpointWriter("every", interval=3)
+    for generation in range(7):
+        writer.submit({"generation": generation}, 0)
+    writer.flush()
+    assert [data["generation"] for data in saved] == [0, 3, 6]
+
+    saved.clear()
+    writer = ai.CheckpointWriter("improved")
+    for generation, score in enumerate((1, 3, 2, 3, 4)):
+        writer.submit({"generation": generation}, score)
+    writer.flush()
+    assert [data["generation"] for data in saved] == [0, 1, 4]
+
+    # Pending checkpoints are coalesced while the writer is busy
+    def slow_save(data):
+        blocked.wait()
+        saved.append(data)
+
+    saved.clear()
+    monkeypatch.setattr(ai, "save_generation_data", slow_save)
+    writer = ai.CheckpointWriter("all", queue_size=2)
+    writer.submit({"generation": 0}, 0)
+    while not writer._writing:
+        time.sleep(0.001)
+    for generation in range(1, 6):
+        writer.submit({"generation": generation}, 0)
+    blocked.set()
+    writer.flush()
+    assert [data["generation"] for data in saved] == [0, 4, 5]
+    assert writer.dropped == 3
+
+
+def test_final_checkpoint(training):
+    _train_model(training, checkpoint_policy="every", checkpoint_interval=5)
+    assert ai._load_generation(-1)["generation"] == 2
+    assert ai._load_generation(1) is None
+
+
+def test_population_resume(training, monkeypatch):
+    monkeypatch.setattr(ai, "SESSION_GENERATIONS", 5)
+    expected = _train_model(training / "uninterrupted", population_interval=2)
+
+    monkeypatch.setattr(ai, "SESSION_GENERATIONS", 3)
+    _train_model(training / "interrupted", population_interval=2)
+    assert ai.load_population()["data"]["generation"] == 2
+
+    monkeypatch.setattr(ai, "SESSION_GENERATIONS", 2)
+    numpy.random.seed(1)  # Replaced by the saved state
+    model = ai.ReinforcementLearningModel(_score, num_agents=6, population_interval=2)
+    assert model.data["generation"] == 2
+    model.train()
+
+    assert model.data["generation"] == expected.data["generation"] == 4
+    assert model.data["ticks"] == expected.data["ticks"]
+    assert numpy.array_equal(model.weights, expected.weights)
+    assert numpy.array_equal(model.biases, expected.biases)
+
+
+def _static_score(agent):
+    agent.ticks += 10
+    return float(agent.forward(numpy.ones(agent.layers[0]))[0])
+
+
+def test_fitness_cache(training):
+    cache = ai.FitnessCache(2)
+    keys = [ai.FitnessCache.key(numpy.ones(3) * i, numpy.zeros(2), 0) for i in range(3)]
+    assert keys[0] != keys[1]
+    assert keys[0] == ai.FitnessCache.key(numpy.zeros(3), numpy.zeros(2), 0)
+    assert keys[0] != ai.FitnessCache.key(numpy.zeros(3), numpy.zeros(2), 1)
+
+    cache.put(keys[0], (1.0, 5))
+    cache.put(keys[1], (2.0, 5))
+    assert cache.get(keys[0]) == (1.0, 5)
+    cache.put(keys[2], (3.0, 5))  # Evicts the least recently used key
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == (1.0, 5)
+    assert len(cache) == 2
+
+    expected = _train_model(training / "uncached", func=_static_score)
+    model = _train_model(
+        training / "cached",
+        func=_static_score,
+        cache_size=16,
+        episode_key=lambda generation: 0,
+    )
+
+    assert numpy.array_equal(model.weights, expected.weights)
+    assert numpy.array_equal(model.biases, expected.biases)
+    assert model.cache_stats[0] >= 1  # The unchanged first agent
+    assert sum(model.cache_stats) == 6
+    # Cached agents are not simulated, but their ticks still count
+    assert model.data["ticks"] == expected.data["ticks"] == 3 * 6 * 11
+    assert 11 <= model.cached_ticks <= 6 * 11
+
+
+def _pruned_score(agent):
+    """
+    Reports an upper bound instead of the score below the best scores.
+    """
+    score = _score(agent)
+    threshold = ai.score_threshold()
+    if score < threshold:
+        return (score + threshold) / 2
+    return score
+
+
+def _estimated_score(agent):
+    """
+    Extrapolates a score above all others.
+    """
+    agent.estimated = True
+    return 10.0
+
+
+def test_score_threshold(training, monkeypatch):
+    assert ai.score_threshold() == -math.inf
+
+    top_scores = multiprocessing.Array("d", [-math.inf] * 4)
+    top_count = multiprocessing.Value("i", 3)
+    for score in (1.0, 4.0, 3.0, 0.0, 2.0):
+        ai._report_score(score, top_scores, top_count)
+    assert list(top_scores) == [4.0, 3.0, 2.0, -math.inf]
+
+    # Extrapolated scores do not tighten the threshold
+    layers = numpy.array([5, 1])
+    weights, biases = numpy.zeros((2, 5)), numpy.zeros((2, 1))
+    tanh = ai.ActivationFunction.tanh
+    with monkeypatch.context() as patch:
+        patch.setattr(ai, "_top_scores", top_scores)
+        patch.setattr(ai, "_top_count", top_count)
+        args = (layers, weights[0], biases[0], tanh, tanh, 0)
+        assert ai._worker_process(_estimated_score, *args) == (10.0, 0)
+        args = (layers, weights, biases, tanh, tanh, 0)
+        results = ai._evaluate_chunk(_estimated_score, None, *args)
+        assert list(results[:, 0]) == [10.0, 10.0]
+    assert list(top_scores) == [4.0, 3.0, 2.0, -math.inf]
+
+    scores = _record_scores(monkeypatch)
+    expected = _train_model(training / "default")
+    expected_scores = scores[:]
+    scores.clear()
+    model = _train_model(training / "pruned", func=_pruned_score, prune=True)
+    assert numpy.array_equal(model.weights, expected.weights)
+
+    # Only agents below the best exact scores are pruned, with an upper bound
+    pruned = 0
+    for generation_scores, exact_scores in zip(scores, expected_scores):
+        threshold = sorted(exact_scores)[-ai.EXACT_AGENTS]
+        for score, exact in zip(generation_scores, exact_scores):
+            if score != exact:
+                pruned += 1
+                assert exact <= threshold
+                assert score >= exact
+    assert pruned > 0
+
+    model = _train_model(
+        training / "cached",
+        func=_pruned_score,
+        prune=True,
+        cache_size=16,
+        episode_key=lambda generation: 0,
+    )
+    assert numpy.array_equal(model.weights, expected.weights)
+    assert numpy.array_equal(model.biases, expected.biases)
+
+
+def _horizon_score(agent):
+    agent.ticks += agent.horizon or 10
+    return _score(agent)
+
+
+def test_successive_halving(training):
+    model = _train_model(training / "raced", func=_horizon_score, rungs=[(2, 0.5)])
+    assert model.rung_ticks == [6 * 3, 3 * 11]  # forward adds one tick
+
+    # Evolution strategies score all agents exactly, but still race them
+    model = _train_model(
+        training / "es", func=_horizon_score, rungs=[(2, 0.5)], optimizer="es"
+    )
+    assert model.rung_ticks == [6 * 3, 3 * 11]
+    assert model.data["ticks"] == 3 * (6 * 3 + 3 * 11)
+
+    model = _train_model(
+        training / "chunked",
+        func=_horizon_score,
+        rungs=[(2, 0.25), (5, 0.5)],
+        chunk_size=0,
+        prune=True,
+    )
+    assert model.rung_ticks == [6 * 3, 2 * 6, 2 * 11]
+
+
+def test_evolution_strategies(training, monkeypatch):
+    monkeypatch.setattr(ai, "SESSION_GENERATIONS", 10)
+    model = _train_model(training / "es", optimizer="es")
+    assert model.exact_agents == 6
+
+    # Every agent holds the mean between generations
+    assert numpy.array_equal(model.weights, model.weights[:1].repeat(6, 0))
+    assert numpy.array_equal(model.biases, model.biases[:1].repeat(6, 0))
+
+    noise = model._sample_population()
+    assert noise.shape == (2, model.weights.shape[1] + model.biases.shape[1])
+    assert numpy.allclose(model.weights[1:3] + model.weights[3:5], 2 * model.weights[0])
+    assert numpy.array_equal(model.weights[5], model.weights[0])
+
+    # The mean climbs the score
+    monkeypatch.setattr(ai, "SESSION_GENERATIONS", 1)
+    initial = _train_model(training / "initial", optimizer="es")
+    tanh = ai.ActivationFunction.tanh
+    scores = [
+        _score(ai.Agent(m.data["layers"], m.weights[0], m.biases[0], tanh, tanh, 0))
+        for m in (initial, model)
+    ]
+    assert scores[1] > scores[0]
+
+
+def test_phase_timing(training, monkeypatch):
+    monkeypatch.setattr(ai, "PROFILE_DIRECTORY", str(training / "profiles"))
+    timing_file = training / "timing.jsonl"
+    _train_model(
+        training / "timed",
+        timing_file=str(timing_file),
+        profile_generation=1,
+        chunk_size=2,
+    )
+
+    with open(timing_file) as fp:
+        records = [json.loads(line) for line in fp]
+    assert [record["generation"] for record in records] == [0, 1, 2]
+    phases = ("mutation", "submit", "wait", "sort", "checkpoint", "selection")
+    for record in records:
+        assert all(record[phase] >= 0 for phase in phases)
+        assert record["tasks"] == 3
+        elapsed = record["submit"] + record["wait"]
+        assert 0 <= record["task_min"] <= record["task_max"] <= elapsed
+        assert 1 <= record["workers"] <= 2
+        assert 0 < record["worker_min"] <= record["worker_max"] <= elapsed
+
+    # Profiles are kept out of the generation directory
+    assert not [name for name in os.listdir(training / "timed") if ".prof" in name]
+    profiles = os.listdir(training / "profiles")
+    assert profiles and all(name.startswith("profile1_") for name in profiles)
+    stats = pstats.Stats(str(training / "profiles" / profiles[0]))
+    assert stats.total_calls > 0
+
+    disabled = ai.PhaseTimer(False)
+    disabled.start()
+    disabled.lap("mutation")
+    assert disabled.phases == {}
+
+
+def test_telemetry(training):
+    telemetry_file = training / "telemetry.jsonl"
+    _train_model(training / "monitored", telemetry_file=str(telemetry_file))
+
+    with open(telemetry_file) as fp:
+        records = [json.loads(line) for line in fp]
+    assert [record["generation"] for record in records] == [0, 1, 2]
+    for record in records:
+        assert record["best"] >= record["median"] >= record["worst"]
+        assert record["ticks"] > 0 and record["generations_per_second"] > 0
+        assert record["weight_changes"] > 0 and record["bias_changes"] > 0
+    assert records[-1]["total_ticks"] == sum(record["ticks"] for record in records)
+
+    stream = ai.TelemetryStream(str(training / "dropped.jsonl"), queue_size=2)
+    with stream._condition:  # Hold the writer back while publishing
+        for generation in range(5):
+            stream.publish({"generation": generation})
+    stream.flush()
+    assert stream.dropped == 3
+    with open(training / "dropped.jsonl") as fp:
+        assert [json.loads(line)["generation"] for line in fp] == [3, 4]
@@ -0,0 +1,153 @@
+import archive
+import pytest
+import numpy
+import json
+import ai
+
+
+def _generation(generation, num_weights=8, num_biases=3):
+    rng = numpy.random.default_rng(generation)
+    return {
+        "generation": generation,
+        "inputs": ["a", "b"],
+        "outputs": ["c"],
+        "layers": numpy.array([2, 2, 1]),
+        "hidden_activation": "tanh",
+        "output_activation": "tanh",
+        "ticks": generation * 3600,
+        "time": generation * 0.5,
+        "weights": rng.uniform(-1, 1, num_weights),
+        "biases": rng.uniform(-1, 1, num_biases),
+    }
+
+
+def test_archive(tmp_path):
+    with pytest.raises(TypeError):  # Abstract base class
+        archive._Archive(str(tmp_path))
+
+    gen_archive = archive.GenerationArchive(str(tmp_path))
+    assert gen_archive.newest() == -1
+    assert gen_archive.load(0) is None
+
+    gen_archive.append(_generation(0), _generation(1))
+    gen_archive.append(_generation(5))  # Gaps are allowed
+    with pytest.raises(ValueError):
+        gen_archive.append(_generation(5))
+    with pytest.raises(ValueError):
+        gen_archive.append(_generation(6, num_biases=4))
+
+    # Incomplete records of interrupted writes are ignored and overwritten
+    with open(gen_archive.path, "ab") as fp:
+        fp.write(b"\0" * 12)
+
+    reader = archive.GenerationArchive(str(tmp_path))
+    assert len(reader) == 3
+    assert reader.newest() == 5
+    assert reader.generations().tolist() == [0, 1, 5]
+    assert reader.load(2) is None
+
+    gen_archive.append(_generation(7))
+    assert reader.newest() == 7
+
+    for generation in (0, 1, 5, 7):
+        data = reader.load(generation)
+        expected = _generation(generation)
+        for key, value in expected.items():
+            if isinstance(value, numpy.ndarray):
+                assert numpy.array_equal(data[key], value)
+            else:
+                assert data[key] == value
+
+
+def test_import_json_generations(tmp_path, monkeypatch):
+    monkeypatch.setattr(ai, "GENERATION_DIRECTORY", str(tmp_path))
+    monkeypatch.setattr(ai, "SAVE_FORMAT", "json")
+    for generation in (0, 3, 4):
+        data = _generation(generation)
+        data["layers"] = data["layers"].tolist()
+        data["weights"] = data["weights"].tolist()
+        data["biases"] = data["biases"].tolist()
+        with open(tmp_path / f"gen{generation}.json", "w") as fp:
+            json.dump(data, fp)
+
+    assert archive.import_json_generations(str(tmp_path)) == 3
+    assert archive.import_json_generations(str(tmp_path)) == 0
+    gen_archive = archive.GenerationArchive(str(tmp_path))
+    assert gen_archive.generations().tolist() == [0, 3, 4]
+
+    # New generations are saved to the archive, old ones still load from JSON
+    (tmp_path / "generations.bin").unlink()
+    monkeypatch.setattr(ai, "SAVE_FORMAT", "archive")
+    ai.save_generation_data(_generation(9))
+    assert ai._load_generation()["generation"] == 9
+    assert ai._load_generation(3)["ticks"] == 3 * 3600
+
+
+@pytest.mark.parametrize(
+    "archive_type", [archive.GenerationArchive, archive.DeltaArchive]
+)
+def test_import_older_json_generations(tmp_path, archive_type):
+    # Training saved a newer generation to the archive before the import
+    gen_archive = archive_type(str(tmp_path))
+    gen_archive.append(_generation(7))
+    for generation in (0, 3, 9):
+        data = _generation(generation)
+        data["layers"] = data["layers"].tolist()
+        data["weights"] = data["weights"].tolist()
+        data["biases"] = data["biases"].tolist()
+        with open(tmp_path / f"gen{generation}.json", "w") as fp:
+            json.dump(data, fp)
+
+    assert archive.import_json_generations(str(tmp_path), gen_archive) == 3
+    assert gen_archive.generations().tolist() == [0, 3, 7, 9]
+    reader = archive_type(str(tmp_path))
+    assert reader.generations().tolist() == [0, 3, 7, 9]
+    for generation in (0, 3, 7, 9):
+        assert numpy.array_equal(
+            reader.load(generation)["weights"], _generation(generation)["weights"]
+        )
+
+    gen_archive.append(_generation(10))
+    assert reader.newest() == 10
+    assert archive.import_json_generations(str(tmp_path), gen_archive) == 0
+    assert not [path for path in tmp_path.iterdir() if path.is_dir()]
+
+
+def test_delta_archive(tmp_path):
+    delta_archive = archive.DeltaArchive(str(tmp_path), keyframe_interval=4)
+    assert delta_archive.newest() == -1
+    assert delta_archive.load(0) is None
+
+    generations = [_generation(0)]
+    for generation in range(1, 12):
+        data = dict(generations[-1])
+        data["generation"] = generation * 2
+        data["ticks"] = generation * 7200
+        data["weights"] = data["weights"].copy()
+        data["weights"][generation % 8] += 0.25
+        if generation == 6:  # Most parameters change
+            data["biases"] = data["biases"] + 1
+            data["weights"] = data["weights"] + 1
+        generations.append(data)
+
+    delta_archive.append(*generations[:5])
+    with pytest.raises(ValueError):
+        delta_archive.append(generations[4])
+
+    # A new instance continues with deltas against the stored parameters
+    delta_archive = archive.DeltaArchive(str(tmp_path), keyframe_interval=4)
+    delta_archive.append(*generations[5:])
+
+    reader = archive.DeltaArchive(str(tmp_path))
+    assert reader.generations().tolist() == list(range(0, 24, 2))
+    index = reader._map_index()
+    keyframes = numpy.flatnonzero(index["keyframe"] == -1).tolist()
+    assert keyframes == [0, 4, 6, 10]
+    assert index["count"][1] == 1
+
+    for expected in generations:
+        data = reader.load(expected["generation"])
+        assert data["ticks"] == expected["ticks"]
+        assert numpy.array_equal(data["weights"], expected["weights"])
+        assert numpy.array_equal(data["biases"], expected["biases"])
+    assert reader.load(3) is None
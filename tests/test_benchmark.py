@@ -0,0 +1,38 @@
+import benchmark
+import pytest
+import ai
+
+
+def test_compare():
+    baseline = {"fast": 1.0, "slow": 1.0, "removed": 1.0}
+    results = {"fast": 0.5, "slow": 1.5, "new": 2.0, "noise": 1.05}
+    assert benchmark.compare(results, baseline | {"noise": 1.0}, 0.1) == {"slow": 1.5}
+
+
+def test_checkpoint_benchmark(monkeypatch):
+    monkeypatch.setattr(benchmark, "NUMBER", 300)
+    directory = ai.GENERATION_DIRECTORY
+    cached = set(ai._archive_cache)
+
+    results = benchmark.benchmark_checkpoint()
+    assert set(results) == {
+        f"{action}_generation_{save_format}"
+        for action in ("save", "load")
+        for save_format in ("archive", "delta", "json")
+    }
+    assert all(seconds > 0 for seconds in results.values())
+    assert ai.GENERATION_DIRECTORY == directory
+    assert ai.SAVE_FORMAT == "archive"
+    assert set(ai._archive_cache) == cached
+
+    # Also restored after errors
+    def save_generation_data(data):
+        if ai.SAVE_FORMAT == "json":
+            raise OSError("Disk full")
+
+    monkeypatch.setattr(ai, "save_generation_data", save_generation_data)
+    with pytest.raises(OSError):
+        benchmark.benchmark_checkpoint()
+    assert ai.GENERATION_DIRECTORY == directory
+    assert ai.SAVE_FORMAT == "archive"
+    assert ai.PRINT_RESULTS
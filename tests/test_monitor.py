@@ -0,0 +1,50 @@
+import monitor
+import json
+
+
+def test_reader(tmp_path):
+    file_name = tmp_path / "telemetry.jsonl"
+    reader = monitor.TelemetryReader(str(file_name), history=3)
+    assert reader.read() == 0
+
+    with open(file_name, "w") as fp:
+        fp.write(json.dumps({"generation": 0}) + "\n" + '{"generation"')
+    assert reader.read() == 1
+
+    with open(file_name, "a") as fp:
+        fp.write(": 1}\n")
+        for generation in range(2, 5):
+            fp.write(json.dumps({"generation": generation}) + "\n")
+    assert reader.read() == 4
+    assert [record["generation"] for record in reader.records] == [2, 3, 4]
+
+    with open(file_name, "w") as fp:
+        fp.write(json.dumps({"generation": 0}) + "\n")
+    assert reader.read() == 1
+    assert [record["generation"] for record in reader.records] == [0]
+
+
+def test_reader_tail(tmp_path, monkeypatch):
+    monkeypatch.setattr(monitor, "TAIL_BLOCK", 16)
+    file_name = tmp_path / "telemetry.jsonl"
+    with open(file_name, "w") as fp:
+        for generation in range(100):
+            fp.write(json.dumps({"generation": generation}) + "\n")
+        fp.write('{"generation"')
+
+    # Only the last history lines are read, not the whole file
+    reader = monitor.TelemetryReader(str(file_name), history=3)
+    with open(file_name, "rb") as fp:
+        start = reader._tail(fp, file_name.stat().st_size)
+    assert file_name.read_bytes()[start:].startswith(b'{"generation": 97}')
+
+    assert reader.read() == 3
+    assert [record["generation"] for record in reader.records] == [97, 98, 99]
+    with open(file_name, "a") as fp:
+        fp.write(": 100}\n")
+    assert reader.read() == 1
+    assert [record["generation"] for record in reader.records] == [98, 99, 100]
+
+    # Files with fewer lines than the history are read from the start
+    reader = monitor.TelemetryReader(str(file_name), history=1000)
+    assert reader.read() == 101
@@ -0,0 +1,98 @@
+from pendulum import Pendulum, PendulumBatch, DELTA_TIME, INTEGRATORS
+from util import Vec
+import pytest
+import random
+import numpy
+import math
+
+
+def test_pendulum_batch():
+    n = 6
+    pendulums = [Pendulum() for _ in range(n)]
+    batch = PendulumBatch(n)
+
+    for i, pendulum in enumerate(pendulums):
+        pendulum.angular_damping = batch.angular_damping[i] = 0.1 + 0.1 * i
+        pendulum.horizontal_damping = batch.horizontal_damping[i] = 0.3 - 0.04 * i
+        pendulum.gravity = batch.gravity[i] = 9.81 - i
+
+    random.seed(0)
+    for _ in range(600):
+        # Large accelerations push the carts against both ends of the rail
+        accelerations = [random.uniform(-60, 60) for _ in range(n)]
+        for pendulum, acceleration in zip(pendulums, accelerations):
+            pendulum.apply_acceleration(Vec(acceleration, 0))
+            pendulum.update()
+        batch.apply_acceleration(numpy.array(accelerations))
+        batch.update()
+
+    for name in ("x", "angle", "angular_velocity", "horizontal_velocity"):
+        expected = [getattr(pendulum, name) for pendulum in pendulums]
+        assert numpy.allclose(getattr(batch, name), expected, rtol=1e-9, atol=1e-9)
+
+    assert numpy.all(numpy.abs(batch.x) <= 1)
+
+
+def _vec_update(pendulum: Pendulum, acceleration: Vec):
+    """
+    The original Vec arithmetic of apply_acceleration, as a reference.
+    """
+    if acceleration.x * pendulum.x > 0 and abs(pendulum.x) >= 1:
+        acceleration.x = 0
+
+    force = acceleration * pendulum.mass
+    moment_of_inertia = pendulum.mass * pendulum.radius**2
+    radius = Vec.from_angle(pendulum.angle) * pendulum.radius
+    angular_acceleration = force.cross(radius) / moment_of_inertia
+    angular_acceleration -= pendulum.angular_damping * pendulum.angular_velocity
+    pendulum.angular_velocity += angular_acceleration * DELTA_TIME
+
+    acceleration.x -= pendulum.horizontal_damping * pendulum.horizontal_velocity
+    pendulum.horizontal_velocity += acceleration.x * DELTA_TIME
+
+
+def test_step():
+    pendulum = Pendulum()
+    reference = Pendulum()
+    pendulum.gravity = reference.gravity = 9.5
+
+    random.seed(0)
+    for _ in range(2000):
+        acceleration = random.uniform(-60, 60)
+        pendulum.step(acceleration)
+        _vec_update(reference, Vec(acceleration, 0))
+        _vec_update(reference, Vec(0, -reference.gravity))
+        reference.update_velocity()
+
+        # Results are identical, not only close
+        assert pendulum.x == reference.x
+        assert pendulum.angle == reference.angle
+        assert pendulum.angular_velocity == reference.angular_velocity
+        assert pendulum.horizontal_velocity == reference.horizontal_velocity
+
+
+def test_integrators():
+    def simulate(integrator, substeps, pendulum):
+        pendulum.angle = -math.pi / 2 + 0.3
+        pendulum.integrator = integrator
+        pendulum.substeps = substeps
+        for tick in range(60):
+            pendulum.step(5 * math.sin(tick), 1 / 20)
+        return pendulum
+
+    reference = simulate("rk4", 300, Pendulum())
+    rk4 = simulate("rk4", 2, Pendulum())
+    semi_implicit = simulate("semi-implicit", 2, Pendulum())
+    assert abs(rk4.angle - reference.angle) < 1e-4
+    assert abs(rk4.angle - reference.angle) < abs(semi_implicit.angle - reference.angle)
+
+    for integrator in INTEGRATORS:
+        pendulum = simulate(integrator, 3, Pendulum())
+        batch = simulate(integrator, 3, PendulumBatch(2))
+        assert numpy.allclose(batch.angle, pendulum.angle, rtol=1e-9)
+        assert numpy.allclose(batch.x, pendulum.x, rtol=1e-9)
+
+    pendulum = Pendulum()
+    pendulum.integrator = "euler"
+    with pytest.raises(ValueError):
+        pendulum.step(0)
@@ -0,0 +1,104 @@
+import render_ai
+import pygame
+import pytest
+import ai
+
+
+@pytest.mark.filterwarnings("ignore:'fc-list' is missing")
+def test_export(tmp_path, monkeypatch):
+    monkeypatch.setenv("SDL_VIDEODRIVER", "dummy")
+    monkeypatch.setattr(render_ai, "GENERATION", 17000)  # Does not write a manifest
+    monkeypatch.setattr(render_ai, "DURATION", 0.25)
+
+    videos = []
+    for name in ("first.rgb", "second.rgb"):
+        monkeypatch.setattr(render_ai, "EXPORT", str(tmp_path / name))
+        window = render_ai.Window()
+        with pytest.raises(SystemExit):
+            while True:
+                window.update()
+        videos.append((tmp_path / name).read_bytes())
+
+    # One frame per tick, equal for equal generations and seeds
+    assert len(videos[0]) == 15 * render_ai.WIDTH * render_ai.HEIGHT * 3
+    assert videos[0] == videos[1]
+
+    surface = pygame.Surface((render_ai.WIDTH, render_ai.HEIGHT))
+    surface.fill((10, 20, 30))
+    writer = render_ai.FrameWriter(str(tmp_path / "frames"), "bmp", queue_size=1)
+    for _ in range(3):
+        writer.write(surface)
+    writer.close()
+
+    assert writer.frames == 3
+    image = pygame.image.load(str(tmp_path / "frames" / "frame000002.bmp"))
+    assert image.get_at((5, 5))[:3] == (10, 20, 30)
+
+
+@pytest.mark.filterwarnings("ignore:'fc-list' is missing")
+def test_simulate(monkeypatch):
+    monkeypatch.setenv("SDL_VIDEODRIVER", "dummy")
+    monkeypatch.setattr(render_ai, "GENERATION", 17000)
+    window = render_ai.Window()
+
+    def frames(count):
+        """
+        Returns the ticks simulated for each of count frames.
+        """
+        result = []
+        for _ in range(count):
+            ticks = window.ticks
+            window.simulate()
+            result.append(window.ticks - ticks)
+        return result
+
+    monkeypatch.setattr(render_ai, "RENDER_EVERY", 7)
+    assert frames(3) == [7, 7, 7]
+    monkeypatch.setattr(render_ai, "SPEED", 0.0)
+    assert frames(2) == [7, 7]  # RENDER_EVERY does not depend on SPEED
+
+    # Fractional ticks per frame are carried over to the next frames
+    monkeypatch.setattr(render_ai, "RENDER_EVERY", 0)
+    monkeypatch.setattr(render_ai, "SPEED", 2.5)
+    assert frames(4) == [2, 3, 2, 3]
+    monkeypatch.setattr(render_ai, "SPEED", 0.5)
+    assert frames(4) == [0, 1, 0, 1]
+
+    # As many ticks as possible within one frame
+    monkeypatch.setattr(render_ai, "SPEED", 0.0)
+    assert frames(1)[0] > 0
+    pygame.quit()
+
+
+@pytest.mark.filterwarnings("ignore:'fc-list' is missing")
+def test_cached_background(monkeypatch):
+    monkeypatch.setenv("SDL_VIDEODRIVER", "dummy")
+    monkeypatch.setattr(render_ai, "GENERATION", 17000)
+    monkeypatch.setattr(render_ai, "RENDER_EVERY", 50)
+    window = render_ai.Window()
+
+    def redraw():
+        """
+        Returns the pixels of a frame drawn without the cached background.
+        """
+        surface = window.window
+        positions = window.get_neuron_positions()
+        surface.fill(render_ai.BLACK)
+        window.draw_rail(surface)
+        for i, layer in enumerate(window.agent.layers):
+            for j in range(layer):
+                window.draw_weights(surface, i, j, positions)
+                window.draw_label(surface, i, j, positions)
+        window.draw_info(surface)
+        window.draw_state()
+        return pygame.surfarray.array3d(surface)
+
+    for frame in range(4):
+        if frame == 2:  # A new agent redraws the background
+            window.agent = ai.Agent.load(16000)
+        window.draw()
+        cached = pygame.surfarray.array3d(window.window)
+        assert (cached == redraw()).all()
+        window.simulate()
+
+    pygame.quit()
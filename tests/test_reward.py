@@ -0,0 +1,38 @@
+import reward
+import numpy
+
+
+def test_score_batch():
+    rng = numpy.random.default_rng(0)
+    ticks, agents = 400, 8
+    x = rng.uniform(-1, 1, (ticks, agents))
+    x[:, 0] = rng.uniform(-0.02, 0.02, ticks)  # Sometimes in the center
+    x[:50, 1] = 0
+    angle = rng.uniform(-numpy.pi, numpy.pi, (ticks, agents))
+    output = rng.uniform(-1, 1, (ticks, agents))
+
+    expected = numpy.zeros(agents)
+    for agent in range(agents):
+        score = last_output = 0
+        for tick in range(ticks):
+            score = reward.score_tick(
+                score,
+                x[tick, agent],
+                angle[tick, agent],
+                output[tick, agent],
+                last_output,
+                tick + 1,
+            )
+            last_output = output[tick, agent]
+        expected[agent] = score
+
+    score = numpy.zeros(agents)
+    last_output = numpy.zeros(agents)
+    for tick in range(ticks):
+        reward.score_tick_batch(
+            score, x[tick], angle[tick], output[tick], last_output, tick + 1
+        )
+        last_output = output[tick]
+
+    assert numpy.array_equal(score, expected)
+    assert numpy.array_equal(reward.score_trajectory(x, angle, output), expected)
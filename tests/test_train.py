@@ -0,0 +1,144 @@
+import pytest
+import numpy
+import train
+import ai
+
+
+def _parameters(num_agents):
+    layers = numpy.array([5, 10, 10, 1])
+    rng = numpy.random.default_rng(0)
+    weights = rng.uniform(-1, 1, (num_agents, sum(layers[1:] * layers[:-1])))
+    biases = rng.uniform(-0.1, 0.1, (num_agents, sum(layers[1:])))
+    return layers, weights, biases
+
+
+def _agents(num_agents, generation=1):
+    tanh = ai.ActivationFunction.tanh
+    return ai.AgentBatch(*_parameters(num_agents), tanh, tanh, generation)
+
+
+@pytest.mark.parametrize(
+    "random_start, distract, stop_on_failure",
+    [(False, False, False), (True, True, False), (False, False, True)],
+)
+def test_train_batch(monkeypatch, random_start, distract, stop_on_failure):
+    monkeypatch.setattr(train, "AGENT_TIME", 240)
+    monkeypatch.setattr(train, "RANDOM_START", random_start)
+    monkeypatch.setattr(train, "DISTRACTIONS", distract)
+    monkeypatch.setattr(train, "STOP_ON_FAILURE", stop_on_failure)
+
+    layers = numpy.array([5, 10, 10, 1])
+    rng = numpy.random.default_rng(0)
+    weights = rng.uniform(-1, 1, (5, sum(layers[1:] * layers[:-1])))
+    biases = rng.uniform(-0.1, 0.1, (5, sum(layers[1:])))
+    tanh = ai.ActivationFunction.tanh
+
+    for generation in (1, 2):
+        agents = ai.AgentBatch(layers, weights, biases, tanh, tanh, generation)
+        scores, ticks = train.train_batch(agents)
+
+        results = zip(weights, biases, scores, ticks, agents.estimated)
+        for w, b, score, tick, estimated in results:
+            agent = ai.Agent(layers, w, b, tanh, tanh, generation)
+            assert train.train(agent) == pytest.approx(score, rel=1e-6)
+            assert agent.ticks == tick
+            assert agent.estimated == estimated == (tick < 240)
+
+    if not stop_on_failure:
+        assert all(ticks == 240)
+
+
+def test_pruning(monkeypatch):
+    monkeypatch.setattr(train, "AGENT_TIME", 600)
+    monkeypatch.setattr(train, "PRUNE_INTERVAL", 10)
+
+    scores, ticks = train.train_batch(_agents(20))
+    monkeypatch.setattr(train, "PRUNE", True)
+    pruned_scores, pruned_ticks = train.train_batch(_agents(20))
+
+    # The best two agents are exact, the others report upper bounds below them
+    best = numpy.argsort(scores)[-2:]
+    assert list(numpy.argsort(pruned_scores)[-2:]) == list(best)
+    assert list(pruned_scores[best]) == list(scores[best])
+    assert all(pruned_scores >= scores)
+    assert pruned_ticks.sum() < ticks.sum()
+
+
+def test_horizon(monkeypatch):
+    monkeypatch.setattr(train, "AGENT_TIME", 240)
+    assert train.rungs("1:0.25,2") == [(60, 0.25), (120, 0.5)]
+
+    agents = _agents(3)
+    agents.horizon = 60
+    scores, ticks = train.train_batch(agents)
+    assert agents.ticks == 60
+    assert list(ticks) == [60] * 3
+
+    monkeypatch.setattr(train, "AGENT_TIME", 60)
+    assert list(train.train_batch(_agents(3))[0]) == list(scores)
+
+
+@pytest.mark.parametrize("aggregate", ["mean", "min", "0.5"])
+def test_scenarios(monkeypatch, aggregate):
+    monkeypatch.setattr(train, "AGENT_TIME", 120)
+    monkeypatch.setattr(train, "RANDOM_START", True)
+    monkeypatch.setattr(train, "DISTRACTIONS", True)
+    monkeypatch.setattr(train, "AGGREGATE", aggregate)
+
+    # Episode k of generation 2 is the single episode of generation 2 * 3 + k
+    single = numpy.array([train.train_batch(_agents(4, 6 + k))[0] for k in range(3)])
+    monkeypatch.setattr(train, "EPISODES", 3)
+    agents = _agents(4, 2)
+    scores, ticks = train.train_batch(agents)
+    assert agents.num_agents == 12
+    assert list(ticks) == [3 * 120] * 4
+    assert numpy.allclose(scores, train.aggregate(single.T))
+
+    # Pruning keeps the best two aggregated scores
+    monkeypatch.setattr(train, "PRUNE", True)
+    monkeypatch.setattr(train, "PRUNE_INTERVAL", 10)
+    pruned_scores, _ = train.train_batch(_agents(4, 2))
+    best = numpy.argsort(scores)[-2:]
+    assert list(numpy.argsort(pruned_scores)[-2:]) == list(best)
+    assert numpy.allclose(pruned_scores[best], scores[best])
+
+
+def test_physics_variation(monkeypatch):
+    monkeypatch.setattr(train, "AGENT_TIME", 60)
+    monkeypatch.setattr(train, "EPISODES", 4)
+    monkeypatch.setattr(train, "PHYSICS_VARIATION", 0.2)
+
+    episodes = train.scenarios(1)
+    assert len(set(episodes["gravity"])) == 4
+    assert all(abs(episodes["gravity"] / 9.81 - 1) <= 0.2)
+
+    # A single agent is simulated as a batch
+    layers, weights, biases = _parameters(1)
+    tanh = ai.ActivationFunction.tanh
+    agent = ai.Agent(layers, weights[0], biases[0], tanh, tanh, 1)
+    assert train.train(agent) == train.train_batch(_agents(1))[0][0]
+    assert agent.ticks == 4 * 60
+
+
+def test_control_rate(monkeypatch):
+    monkeypatch.setattr(train, "AGENT_TIME", 241)
+    monkeypatch.setattr(train, "DISTRACTIONS", True)
+    monkeypatch.setattr(train, "CONTROL_TICKS", 3)
+    monkeypatch.setattr(train, "INTEGRATOR", "rk4")
+    monkeypatch.setattr(train, "SUBSTEPS", 2)
+
+    agents = _agents(3)
+    scores, ticks = train.train_batch(agents)
+    assert list(ticks) == [241] * 3  # The last decision only lasts one tick
+
+    layers, weights, biases = _parameters(3)
+    tanh = ai.ActivationFunction.tanh
+    for w, b, score in zip(weights, biases, scores):
+        agent = ai.Agent(layers, w, b, tanh, tanh, 1)
+        assert train.train(agent) == pytest.approx(score, rel=1e-6)
+        assert agent.ticks == 241
+
+    assert train.control_ticks(20) == 3
+    for rate in (0, -20, 7, 120):
+        with pytest.raises(ValueError):
+            train.control_ticks(rate)
@@ -0,0 +1,49 @@
+import pytest
+import numpy
+import train_pg
+import train
+import ai
+
+
+def test_network_gradients():
+    rng = numpy.random.default_rng(0)
+    for output_activation in ("tanh", None):
+        network = train_pg.Network([3, 4, 2], output_activation, rng)
+        inputs = rng.normal(size=(5, 3))
+        targets = rng.normal(size=(5, 2))
+
+        def loss():
+            return 0.5 * numpy.sum((network.forward(inputs) - targets) ** 2)
+
+        gradients = network.backward(network.forward(inputs) - targets)
+        for parameter, gradient in zip(network.parameters(), gradients):
+            index = (0,) * parameter.ndim
+            parameter[index] += 1e-6
+            increased = loss()
+            parameter[index] -= 2e-6
+            decreased = loss()
+            parameter[index] += 1e-6
+            assert gradient[index] == pytest.approx((increased - decreased) / 2e-6)
+
+
+def test_policy_checkpoint(tmp_path, monkeypatch):
+    monkeypatch.setattr(ai, "GENERATION_DIRECTORY", str(tmp_path))
+    monkeypatch.setattr(ai, "PRINT_RESULTS", False)
+    monkeypatch.setattr(train, "AGENT_TIME", 30)
+    monkeypatch.setattr(train_pg, "NUM_ENVS", 4)
+    monkeypatch.setattr(train_pg, "ITERATIONS", 2)
+
+    train_pg.main()
+    agent = ai.Agent.load()
+    assert agent.generation == 1
+    assert agent.ticks == 2 * 30 * 4
+
+    # The saved agent computes the same policy
+    policy = train_pg.Network(agent.layers, agent=agent)
+    inputs = numpy.linspace(-1, 1, agent.layers[0])
+    expected = policy.forward(inputs[numpy.newaxis, :])[0]
+    assert numpy.allclose(agent.forward(inputs), expected)
+
+    # Training continues from the newest generation
+    train_pg.main()
+    assert ai.Agent.load().generation == 3
@@ -32,6 +32,19 @@ def test_vec():
     assert Vec(1, 0).rotated(math.pi / 2).round(3) == Vec(0, 1)
 
 
+def test_vec_in_place():
+    vec = Vec(1, 2)
+    alias = vec
+    vec += Vec(1, 1)
+    vec -= Vec(0, 1)
+    vec *= 3
+    vec /= 2
+    assert vec is alias
+    assert vec == Vec(3, 3)
+
+    assert not hasattr(vec, "__dict__")
+
+
 def test_argv():
     sys.argv.extend(
         [